@@ -1,16 +1,32 @@
+import time
+
+# Measure the startup time from the first import on.
+start_time = time.perf_counter()
+
 import logging
+import multiprocessing
+import sys
 
 from voluba_mriwarp.config import mriwarp_name
-from voluba_mriwarp.gui import App
 from voluba_mriwarp.logging import setup_logger
 
 
 if __name__ == '__main__':
+    # Needed for process pools in the frozen Windows application.
+    multiprocessing.freeze_support()
+
+    # voluba-mriwarp batch ... runs without GUI.
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        from voluba_mriwarp.batch import main
+        sys.exit(main(sys.argv[2:]))
+
+    from voluba_mriwarp.gui import App
+
     setup_logger()
     logger = logging.getLogger(mriwarp_name)
     logger.info('Start app')
     try:
-        gui = App()
+        gui = App(start_time)
     except Exception as e:
         logger.error(str(e))
     logger.info('Close app')
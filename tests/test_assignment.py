@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+
+import nibabel as nib
+import numpy as np
+import pytest
+from scipy import ndimage
+
+siibra = pytest.importorskip('siibra')
+import siibra.commons
+from siibra.commons import create_gaussian_kernel
+from siibra.volumes.parcellationmap import Map
+
+from voluba_mriwarp.assignment import VoxelIndex
+
+# absolute tolerance for the scores of the assignment
+TOLERANCE = 1e-9
+# shape and affine of the synthetic statistical map
+SHAPE = (40, 44, 36)
+AFFINE = np.array([[1.5, 0., 0., -30.],
+                   [0., 1.5, 0., -33.],
+                   [0., 0., 1.5, -27.],
+                   [0., 0., 0., 1.]])
+# columns of Map.assign and the score of siibra.commons.compare_maps
+SCORES = {'correlation': 'correlation',
+          'intersection over union': 'intersection_over_union',
+          'map weighted mean': 'weighted_mean_of_first',
+          'map containedness': 'intersection_over_first',
+          'input weighted mean': 'weighted_mean_of_second',
+          'input containedness': 'intersection_over_second'}
+
+
+class Region:
+    def __init__(self, name):
+        self.name = name
+
+
+class Parcellation:
+    def get_region(self, name):
+        return Region(name)
+
+
+class StatisticalMap:
+    """Minimal statistical map that Map._assign_image and VoxelIndex work
+    with
+    """
+    fragments = set()
+    parcellation = Parcellation()
+
+    def __init__(self, volumes):
+        self.images = [nib.Nifti1Image(volume, AFFINE) for volume in volumes]
+        self._indices = {
+            f'region {volume}': [siibra.MapIndex(volume=volume, label=None)]
+            for volume in range(len(volumes))}
+
+    def __len__(self):
+        return len(self.images)
+
+    def fetch_iter(self, fragment=None):
+        return iter(self.images)
+
+    def get_region(self, index):
+        return Region(f'region {index.volume}')
+
+
+@pytest.fixture(scope='module')
+def pmap():
+    """Create smooth, overlapping probability maps."""
+    rng = np.random.default_rng(0)
+    volumes = []
+    for _ in range(8):
+        volume = np.zeros(SHAPE, dtype=np.float32)
+        volume[tuple(rng.integers(5, 31, 3))] = 1
+        volume = ndimage.gaussian_filter(volume, rng.uniform(2, 4))
+        volume[volume < volume.max() * 0.05] = 0
+        volumes.append(volume / volume.max())
+    return StatisticalMap(volumes)
+
+
+@pytest.fixture(scope='module')
+def index(pmap, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('voxel_index') / 'index')
+    VoxelIndex.build(pmap, path)
+    return VoxelIndex(path, pmap)
+
+
+def assign(pmap, coordinate, sigma):
+    """Assign a point like Map._assign_points for uncertain points."""
+    sigma_vox = sigma / np.mean(
+        [np.linalg.norm(AFFINE[:, i]) for i in range(3)])
+    kernel = create_gaussian_kernel(sigma_vox, 3)
+    radius = int(kernel.shape[0] / 2)
+    voxel = (np.linalg.inv(AFFINE) @ np.append(coordinate, 1)
+             + 0.5).astype(int)
+    shift = np.identity(4)
+    shift[:3, -1] = voxel[:3] - radius
+    kernel = nib.Nifti1Image(kernel, AFFINE @ shift)
+    return Map._assign_image(pmap, kernel, minsize_voxel=1,
+                             lower_threshold=0.0)
+
+
+@pytest.fixture
+def uncached_compare_maps(monkeypatch):
+    """Disable the cache of the non-zero voxels in compare_maps.
+
+    The cache is keyed by the id of temporary arrays, so a freed array may
+    return the voxels of another one.
+    """
+    monkeypatch.setattr(siibra.commons, 'nonzero_coordinates',
+                        lambda array: np.c_[np.nonzero(array > 0)])
+
+
+@pytest.mark.parametrize('sigma', [5, 8, 12])
+def test_gaussian_assignment_matches_siibra(pmap, index, sigma,
+                                            uncached_compare_maps):
+    rng = np.random.default_rng(sigma)
+    # Include a point near the border where the cube is cropped.
+    coordinates = [*rng.uniform(-20, 20, size=(3, 3)), (-28., 25., 20.)]
+    for coordinate in coordinates:
+        point = SimpleNamespace(coordinate=tuple(coordinate), sigma=sigma)
+        expected = assign(pmap, coordinate, sigma)
+        assignments = index.assign(point)
+
+        assert assignments.volume.tolist() == [
+            result.volume for result in expected]
+        for result, (_, row) in zip(expected, assignments.iterrows()):
+            assert row.region.name == f'region {result.volume}'
+            for column, score in SCORES.items():
+                assert row[column] == pytest.approx(
+                    getattr(result, score), abs=TOLERANCE)
@@ -0,0 +1,50 @@
+import nibabel as nib
+import numpy as np
+import pytest
+
+from voluba_mriwarp.logic import Logic
+
+# Shape of the synthetic input. Its coronal slices are large enough that
+# the volume is quantized in several slabs.
+SHAPE = (170, 130, 200)
+
+
+@pytest.fixture(scope='module')
+def source(tmp_path_factory):
+    """Write an int16 NIfTI with an oblique, non-RAS affine."""
+    rng = np.random.default_rng(0)
+    data = rng.integers(-200, 3000, size=SHAPE, dtype=np.int16)
+    affine = np.array([[0., 0., -1.2, 90.],
+                       [-1., 0.05, 0., 120.],
+                       [0., 0.9, 0., -70.],
+                       [0., 0., 0., 1.]])
+    path = tmp_path_factory.mktemp('logic') / 'sub-01_T1w.nii'
+    nib.save(nib.Nifti1Image(data, affine), path)
+    return path
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_quantization_round_trip(source, tmp_path, compressed):
+    if compressed:
+        path = tmp_path / 'sub-01_T1w.nii.gz'
+        nib.save(nib.load(source), path)
+    else:
+        path = source
+    logic = Logic()
+    logic.set_out_path(str(tmp_path))
+    logic.set_in_path(str(path))
+
+    # Reference: canonical orientation, rotated for display and scaled to
+    # the full uint8 range in floating point.
+    data = nib.funcs.as_closest_canonical(nib.load(path)).get_fdata()
+    reference = np.rot90(data, axes=(0, 2)) * 255 / data.max()
+    reference = np.clip(reference, 0, 255)
+
+    image = logic.get_numpy_source()
+    assert image.dtype == np.uint8
+    assert image.shape == reference.shape
+    # Quantization truncates in float32, so values differ by at most one
+    # level.
+    assert np.abs(image - reference).max() <= 1
+    # Each coronal slice is one contiguous block.
+    assert image[:, 0, :].flags['C_CONTIGUOUS']
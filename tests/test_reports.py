@@ -0,0 +1,60 @@
+import os
+
+import matplotlib
+import pytest
+from PIL import Image
+
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+pytest.importorskip('siibra')
+from voluba_mriwarp.config import quality_profiles
+from voluba_mriwarp.reports import _save_figure
+
+# size of the test figure in inches
+FIGSIZE = (4, 3)
+
+
+@pytest.fixture
+def fig():
+    fig, ax = plt.subplots(figsize=FIGSIZE)
+    ax.imshow([[0, 1], [2, 3]], cmap='viridis')
+    ax.plot([0, 1], [1, 0])
+    yield fig
+    plt.close(fig)
+
+
+@pytest.mark.parametrize('quality', quality_profiles)
+def test_raster_profile(fig, tmp_path, quality):
+    profile = quality_profiles[quality]
+    filename = _save_figure(fig, str(tmp_path / 'figure'), quality)
+
+    extension = {'jpeg': '.jpg', 'png': '.png'}[profile['format']]
+    assert filename.endswith(extension)
+    with Image.open(filename) as image:
+        assert image.format == profile['format'].upper()
+        assert image.size == tuple(
+            round(size * profile['dpi']) for size in FIGSIZE)
+        # PNG stores the resolution in pixels per metre.
+        assert image.info['dpi'] == pytest.approx(
+            (profile['dpi'], profile['dpi']), abs=0.1)
+        if profile['colors']:
+            assert image.mode == 'P'
+            assert len(image.getcolors()) <= profile['colors']
+
+
+@pytest.mark.parametrize('quality', quality_profiles)
+def test_vector_profile(fig, tmp_path, quality):
+    profile = quality_profiles[quality]
+    filename = _save_figure(fig, str(tmp_path / 'figure'), quality,
+                            vector=True)
+    if profile['vector']:
+        assert filename.endswith('.svg')
+    else:
+        assert not filename.endswith('.svg')
+
+
+def test_draft_smaller_than_screen(fig, tmp_path):
+    draft = _save_figure(fig, str(tmp_path / 'draft'), 'draft')
+    screen = _save_figure(fig, str(tmp_path / 'screen'), 'screen')
+    assert os.path.getsize(draft) < os.path.getsize(screen)
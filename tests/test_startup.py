@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from voluba_mriwarp.config import startup_budget
+
+# The app loads its data relative to the repository root.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(code):
+    """Run code in a fresh interpreter and return the last number it
+    prints.
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', textwrap.dedent(code)], cwd=ROOT,
+        capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_time():
+    pytest.importorskip('tkfontawesome')
+    seconds = measure('''
+        import time
+        start = time.perf_counter()
+        import voluba_mriwarp.gui
+        print(time.perf_counter() - start)
+        ''')
+    assert seconds < startup_budget, \
+        f'Importing the GUI took {seconds:.2f} s (budget {startup_budget} s)'
+
+
+@pytest.mark.skipif(
+    sys.platform.startswith('linux') and not os.environ.get('DISPLAY'),
+    reason='needs a display')
+def test_first_window():
+    pytest.importorskip('tkfontawesome')
+    seconds = measure('''
+        import time
+        start = time.perf_counter()
+        from voluba_mriwarp.gui import App
+        # Close the app instead of entering the main loop.
+        App.mainloop = lambda self: self.destroy()
+        print(App(start).startup_time)
+        ''')
+    assert seconds < startup_budget, \
+        f'First window shown after {seconds:.2f} s ' \
+        f'(budget {startup_budget} s)'
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from voluba_mriwarp.transforms import CompositeTransform
+
+sitk = pytest.importorskip('SimpleITK')
+
+# Maximum deviation in mm from ITK. The displacement field is read as 
+# float32.
+TOLERANCE = 1e-5
+
+
+@pytest.fixture(scope='module')
+def composite(tmp_path_factory):
+    """Write a synthetic affine and displacement field composite transform
+    like the ones written by antsRegistration.
+    """
+    rng = np.random.default_rng(0)
+    affine = sitk.AffineTransform(3)
+    affine.SetMatrix((1.1, 0.05, 0, 0.02, 0.9, 0.1, 0, 0.03, 1.05))
+    affine.SetTranslation((3, -2, 5))
+    affine.SetCenter((10, 20, -5))
+
+    # oblique field with anisotropic spacing
+    direction = np.array([[0.99, 0.1, 0], [-0.1, 0.99, 0], [0, 0, 1]])
+    direction /= np.linalg.norm(direction, axis=0)
+    field = sitk.GetImageFromArray(
+        rng.normal(size=(18, 24, 20, 3)) * 2, isVector=True)
+    field.SetOrigin((-30, -40, -20))
+    field.SetSpacing((3, 2.5, 3.5))
+    field.SetDirection(tuple(direction.flatten()))
+    displacement = sitk.DisplacementFieldTransform(
+        sitk.Cast(field, sitk.sitkVectorFloat64))
+
+    transform = sitk.CompositeTransform([affine, displacement])
+    path = str(tmp_path_factory.mktemp('transforms') / 'composite.h5')
+    sitk.WriteTransform(transform, path)
+    return path, transform
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_composite_matches_itk(composite, mmap):
+    path, reference = composite
+    # Points inside and outside of the displacement field.
+    points = np.random.default_rng(1).uniform(-50, 60, size=(2000, 3))
+
+    transformed = CompositeTransform(path, mmap=mmap).transform_points(points)
+
+    expected = np.array([reference.TransformPoint(tuple(point))
+                         for point in points])
+    assert np.abs(transformed - expected).max() < TOLERANCE
+
+
+def test_unsupported_transform(tmp_path):
+    path = str(tmp_path / 'euler.h5')
+    sitk.WriteTransform(sitk.CompositeTransform(
+        [sitk.Euler3DTransform((0, 0, 0), 0.1, 0.2, 0.3)]), path)
+
+    with pytest.raises(NotImplementedError):
+        CompositeTransform(path)
@@ -0,0 +1,104 @@
+from collections import deque
+from itertools import count
+
+import pytest
+from PIL import Image
+
+from voluba_mriwarp.config import (interactive_filter, refine_delay,
+                                   settled_filter)
+from voluba_mriwarp.viewer import ImageCanvas
+
+INTERACTIVE = getattr(Image, interactive_filter.upper())
+SETTLED = getattr(Image, settled_filter.upper())
+
+
+class FakeCanvas:
+    """Tk canvas recording scheduled callbacks instead of running an event
+    loop
+    """
+
+    def __init__(self):
+        self.ids = count()
+        self.idle = {}
+        self.timers = {}
+
+    def after_idle(self, callback):
+        callback_id = f'after#{next(self.ids)}'
+        self.idle[callback_id] = callback
+        return callback_id
+
+    def after(self, delay, callback):
+        callback_id = f'after#{next(self.ids)}'
+        self.timers[callback_id] = (delay, callback)
+        return callback_id
+
+    def after_cancel(self, callback_id):
+        self.idle.pop(callback_id, None)
+        self.timers.pop(callback_id, None)
+
+    def itemconfig(self, *args, **kwargs):
+        pass
+
+    def run_idle(self):
+        """Run the callbacks Tk runs once the event queue is empty."""
+        while self.idle:
+            self.idle.pop(next(iter(self.idle)))()
+
+    def run_timers(self):
+        """Run the timers as if no event arrived until they expired."""
+        while self.timers:
+            _, callback = self.timers.pop(next(iter(self.timers)))
+            callback()
+
+
+@pytest.fixture
+def canvas():
+    """Create an image canvas without Tk that records the filter of each
+    render.
+    """
+    canvas = object.__new__(ImageCanvas)
+    state = {'filters': {'interactive': INTERACTIVE, 'settled': SETTLED},
+             'annotation': (-1, -1, -1), 'render_pending': False,
+             'callbacks': set(), 'interactive': False, 'refine_id': None}
+    for name, value in state.items():
+        setattr(canvas, f'_ImageCanvas__{name}', value)
+    canvas.frame_times = {'interactive': deque(), 'settled': deque()}
+    canvas.canvas = FakeCanvas()
+    canvas.renders = []
+    canvas._ImageCanvas__show_image = canvas.renders.append
+    return canvas
+
+
+def test_interaction_is_refined(canvas):
+    # Slider events between two idle phases are rendered once.
+    for slice in range(5):
+        canvas.update(None, slice)
+    canvas.canvas.run_idle()
+    assert canvas.renders == [INTERACTIVE]
+    assert [delay for delay, _ in canvas.canvas.timers.values()] == [
+        refine_delay]
+
+    canvas.canvas.run_timers()
+    assert canvas.renders == [INTERACTIVE, SETTLED]
+    assert {mode: len(times) for mode, times in
+            canvas.frame_times.items()} == {'interactive': 1, 'settled': 1}
+    assert not canvas._ImageCanvas__callbacks
+
+
+def test_interaction_postpones_refinement(canvas):
+    canvas.update(None, 0)
+    canvas.canvas.run_idle()
+    canvas.update(None, 1)
+    canvas.canvas.run_idle()
+    # The refinement of the first render was cancelled.
+    assert len(canvas.canvas.timers) == 1
+
+    canvas.canvas.run_timers()
+    assert canvas.renders == [INTERACTIVE, INTERACTIVE, SETTLED]
+
+
+def test_settled_render(canvas):
+    canvas.schedule_render()
+    canvas.canvas.run_idle()
+    assert canvas.renders == [SETTLED]
+    assert not canvas.canvas.timers
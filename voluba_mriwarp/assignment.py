@@ -0,0 +1,594 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import siibra
+
+from voluba_mriwarp.cache import hash_key
+from voluba_mriwarp.config import (assignment_workers, cache_home,
+                                   map_cache_budget, mriwarp_name,
+                                   use_voxel_index)
+
+# columns of the assignment table returned by siibra.Map.assign
+ASSIGNMENT_COLUMNS = [
+    'input structure', 'centroid', 'volume', 'fragment', 'region',
+    'correlation', 'intersection over union', 'map value',
+    'map weighted mean', 'map containedness', 'input weighted mean',
+    'input containedness']
+# version of the on-disk index format, part of the index key
+INDEX_FORMAT = 2
+
+
+class VoxelIndex:
+    """Sparse index mapping each voxel of a statistical parcellation map to
+    the volumes (regions) with a non-zero value in this voxel
+
+    The index is stored in compressed sparse row format: the entries of voxel
+    i are volumes[indptr[i]:indptr[i + 1]] and values[indptr[i]:indptr[i + 1]].
+    For each volume, totals holds the number of non-zero voxels, the sum and
+    the sum of squares of its values.
+    """
+
+    def __init__(self, path, pmap, mmap=True):
+        """Load an index from disk.
+
+        :param str path: folder of the index
+        :param siibra.Map pmap: statistical map the index was built from
+        :param bool mmap: memory-map the index instead of reading it into 
+        memory
+        """
+        mmap_mode = 'r' if mmap else None
+        self.path = path
+        self.pmap = pmap
+        with open(os.path.join(path, 'meta.json'), 'r') as file:
+            meta = json.load(file)
+        self.shape = tuple(meta['shape'])
+        self.affine = np.array(meta['affine'])
+        self.region_names = meta['regions']
+        self.indptr = np.load(
+            os.path.join(path, 'indptr.npy'), mmap_mode=mmap_mode)
+        self.volumes = np.load(
+            os.path.join(path, 'volumes.npy'), mmap_mode=mmap_mode)
+        self.values = np.load(
+            os.path.join(path, 'values.npy'), mmap_mode=mmap_mode)
+        self.totals = np.load(os.path.join(path, 'totals.npy'))
+        self.__phys2vox = np.linalg.inv(self.affine)
+        # Same approximation of the voxel size as in siibra.
+        self.__scaling = np.mean(
+            [np.linalg.norm(self.affine[:, i]) for i in range(3)])
+        self.__regions = {}
+
+    @staticmethod
+    def get_path(pmap):
+        """Return the folder of the index of a statistical map.
+
+        :param siibra.Map pmap: statistical map
+        :return: folder of the index
+        :rtype: str
+        """
+        key = hash_key(pmap.id, pmap.space.id, str(pmap.maptype),
+                       siibra.__version__, INDEX_FORMAT)
+        return os.path.join(cache_home, 'voxel_index', key[:16])
+
+    @classmethod
+    def load(cls, pmap, mmap=True):
+        """Load the index of a statistical map and build it if necessary.
+
+        :param siibra.Map pmap: statistical map
+        :param bool mmap: memory-map the index instead of reading it into 
+        memory
+        :return: index of the map
+        :rtype: VoxelIndex
+        :raise NotImplementedError: if the map is split into fragments
+        """
+        path = cls.get_path(pmap)
+        if not os.path.isfile(os.path.join(path, 'meta.json')):
+            cls.build(pmap, path)
+        return cls(path, pmap, mmap)
+
+    @property
+    def nbytes(self):
+        """Return the size of the index in bytes."""
+        return sum(array.nbytes for array in
+                   [self.indptr, self.volumes, self.values, self.totals])
+
+    @staticmethod
+    def build(pmap, path):
+        """Build the index of a statistical map and save it to disk.
+
+        :param siibra.Map pmap: statistical map
+        :param str path: folder to save the index to
+        :raise NotImplementedError: if the map is split into fragments
+        """
+        if pmap.fragments:
+            raise NotImplementedError(
+                f'{pmap} is split into fragments which are not supported.')
+        logging.getLogger(mriwarp_name).info(
+            f'Building voxel index for {pmap} in {path}')
+
+        shape, affine = None, None
+        linear_indices, volumes, values, regions = [], [], [], []
+        totals = []
+        for volume, image in enumerate(pmap.fetch_iter()):
+            data = np.asanyarray(image.dataobj)
+            if shape is None:
+                shape, affine = data.shape[:3], image.affine
+            elif data.shape[:3] != shape or not np.allclose(
+                    image.affine, affine):
+                raise NotImplementedError(
+                    f'The volumes of {pmap} are not defined on a common '
+                    f'grid.')
+            coordinates = np.nonzero(data > 0)
+            linear_indices.append(np.ravel_multi_index(coordinates, shape))
+            volumes.append(np.full(len(coordinates[0]), volume, np.int32))
+            values.append(data[coordinates])
+            totals.append([len(values[-1]), values[-1].sum(dtype=np.float64),
+                           np.square(values[-1], dtype=np.float64).sum()])
+            regions.append(pmap.get_region(
+                index=siibra.MapIndex(volume=volume, label=None)).name)
+
+        # Sort the entries by voxel. The stable sort keeps the volume order
+        # within a voxel.
+        linear_indices = np.concatenate(linear_indices)
+        order = np.argsort(linear_indices, kind='stable')
+        counts = np.bincount(linear_indices, minlength=np.prod(shape))
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+
+        # Write to a temporary folder first so that an interrupted build is
+        # not mistaken for an index.
+        tmp_path = f'{path}_{os.getpid()}.part'
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, 'indptr.npy'), indptr)
+        np.save(os.path.join(tmp_path, 'volumes.npy'),
+                np.concatenate(volumes)[order])
+        np.save(os.path.join(tmp_path, 'values.npy'),
+                np.concatenate(values)[order])
+        np.save(os.path.join(tmp_path, 'totals.npy'),
+                np.array(totals, dtype=np.float64))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as file:
+            json.dump({'shape': list(shape), 'affine': affine.tolist(),
+                       'regions': regions,
+                       'siibra': siibra.__version__}, file, indent=4)
+        # Indices are keyed by map and siibra version, so an index that
+        # another process finished in the meantime is identical. Keep it, as
+        # it may already be in use.
+        if os.path.isdir(path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def is_voxel_precise(self, sigma_mm):
+        """Check if siibra reads out single voxels for the given uncertainty.
+
+        :param float sigma_mm: uncertainty of a point in mm
+        :return: True if the assignment is a voxel lookup, False otherwise.
+        :rtype: bool
+        """
+        return sigma_mm / self.__scaling < 3
+
+    def __get_voxel(self, coordinate):
+        """Return the voxel containing a point, rounded like in siibra.
+
+        :param tuple coordinate: point in the physical space of the map
+        :return: voxel index
+        :rtype: numpy.ndarray
+        """
+        return (self.__phys2vox @ np.append(coordinate, 1) + 0.5).astype(
+            int)[:3]
+
+    def lookup(self, coordinate):
+        """Return the entries of the voxel containing a point.
+
+        :param tuple coordinate: point in the physical space of the map
+        :return: volume indices and map values of the voxel
+        :rtype: numpy.ndarray, numpy.ndarray
+        :raise IndexError: if the point is outside the map
+        """
+        voxel = self.__get_voxel(coordinate)
+        # Wrap negative indices like numpy.
+        for index, size in zip(voxel, self.shape):
+            if not -size <= index < size:
+                raise IndexError(
+                    f'index {index} is out of bounds for size {size}')
+        linear_index = np.ravel_multi_index(
+            tuple(voxel % self.shape), self.shape)
+        start, stop = self.indptr[linear_index], self.indptr[linear_index + 1]
+        return self.volumes[start:stop], self.values[start:stop]
+
+    def get_region(self, volume):
+        """Return the region of a volume of the map.
+
+        :param int volume: volume index
+        :return: region mapped in the volume
+        :rtype: siibra.Region
+        """
+        if volume not in self.__regions:
+            self.__regions[volume] = self.pmap.parcellation.get_region(
+                self.region_names[volume])
+        return self.__regions[volume]
+
+    def crop(self, lower, upper):
+        """Return all entries of the voxels within a bounding box.
+
+        As the voxels are stored in C order, the entries of each row along
+        the last axis are contiguous and are read as one slice.
+
+        :param numpy.ndarray lower: first voxel of the box
+        :param numpy.ndarray upper: voxel after the last voxel of the box
+        :return: volume indices and map values of the voxels in the box
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        x, y = np.meshgrid(np.arange(lower[0], upper[0]),
+                           np.arange(lower[1], upper[1]), indexing='ij')
+        first = np.ravel_multi_index(
+            (x.ravel(), y.ravel(), np.full(x.size, lower[2])), self.shape)
+        starts = self.indptr[first]
+        stops = self.indptr[first + upper[2] - lower[2]]
+        # Concatenate the ranges start:stop of all rows without a loop.
+        counts = stops - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        entries = offsets + np.arange(counts.sum())
+        return self.volumes[entries], self.values[entries]
+
+    def assign(self, point):
+        """Assign a point to regions.
+
+        The result equals siibra.Map.assign. Points with an uncertainty below
+        three voxels are assigned by looking up their voxel. For larger
+        uncertainties, siibra compares each map with a cube of three sigma
+        around the point. Here all maps are compared at once using the entries
+        within the cube and the precomputed totals of the maps.
+
+        :param siibra.Point point: point in the space of the map
+        :return: assignments of the point
+        :rtype: pandas.DataFrame
+        :raise IndexError: if the point is outside the map
+        """
+        if self.is_voxel_precise(point.sigma):
+            return self.__assign_voxels([point])[0]
+        return self.__assign_gaussian(point)
+
+    def assign_batch(self, points):
+        """Assign multiple points to regions.
+
+        Voxel-precise points are looked up at once and their assignments are
+        built as a single table.
+
+        :param list points: points in the space of the map
+        :return: assignments of each point
+        :rtype: list
+        :raise IndexError: if a point is outside the map
+        """
+        precise = [i for i, point in enumerate(points)
+                   if self.is_voxel_precise(point.sigma)]
+        assignments = [None] * len(points)
+        if precise:
+            for i, assignment in zip(precise, self.__assign_voxels(
+                    [points[i] for i in precise])):
+                assignments[i] = assignment
+        for i, point in enumerate(points):
+            if assignments[i] is None:
+                assignments[i] = self.__assign_gaussian(point)
+        return assignments
+
+    def __assign_voxels(self, points):
+        """Assign points to regions by looking up their voxels.
+
+        :param list points: points in the space of the map
+        :return: assignments of each point
+        :rtype: list
+        :raise IndexError: if a point is outside the map
+        """
+        coordinates = np.array(
+            [point.coordinate for point in points], dtype=float)
+        voxels = (np.c_[coordinates, np.ones(len(points))]
+                  @ self.__phys2vox.T + 0.5).astype(int)[:, :3]
+        # Wrap negative indices like numpy.
+        shape = np.array(self.shape)
+        outside = np.flatnonzero(np.any(
+            (voxels < -shape) | (voxels >= shape), axis=1))
+        if len(outside):
+            raise IndexError(
+                f'{points[outside[0]].coordinate} is outside of the map')
+        linear_indices = np.ravel_multi_index(
+            tuple((voxels % shape).T), self.shape)
+
+        # Concatenate the entries of all voxels without a loop.
+        starts = self.indptr[linear_indices]
+        counts = self.indptr[linear_indices + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        entries = offsets + np.arange(counts.sum())
+        if len(entries) == 0:
+            return [pd.DataFrame(columns=ASSIGNMENT_COLUMNS) for _ in points]
+        volumes = self.volumes[entries].astype(int)
+        structures = np.repeat(np.arange(len(points)), counts)
+        centroids = [tuple(centroid) for centroid in coordinates.round(2)]
+
+        assignments = pd.DataFrame({
+            'input structure': structures,
+            'centroid': [centroids[i] for i in structures],
+            'volume': volumes, 'fragment': None,
+            'region': [self.get_region(volume) for volume in volumes],
+            'correlation': None, 'intersection over union': None,
+            'map value': self.values[entries], 'map weighted mean': None,
+            'map containedness': None, 'input weighted mean': None,
+            'input containedness': None})
+        return split_assignments(
+            assignments.convert_dtypes().reindex(columns=ASSIGNMENT_COLUMNS),
+            len(points))
+
+    def __assign_gaussian(self, point):
+        """Assign a point with uncertainty to regions by comparing a cube of
+        three sigma around the point with all maps.
+
+        :param siibra.Point point: point in the space of the map
+        :return: assignments of the point
+        :rtype: pandas.DataFrame
+        """
+        radius = int(3 * point.sigma / self.__scaling)
+        voxel = self.__get_voxel(point.coordinate)
+        lower = np.maximum(voxel - radius, 0)
+        upper = np.minimum(voxel + radius + 1, self.shape)
+        if np.any(lower >= upper):
+            return pd.DataFrame(columns=ASSIGNMENT_COLUMNS)
+
+        volumes, values = self.crop(lower, upper)
+        n_volumes = len(self.region_names)
+        intersection = np.bincount(volumes, minlength=n_volumes)
+        hits = np.flatnonzero(intersection)
+        if len(hits) == 0:
+            return pd.DataFrame(columns=ASSIGNMENT_COLUMNS)
+        intersection = intersection[hits].astype(np.float64)
+        map_sum = np.bincount(volumes, weights=values.astype(np.float64),
+                              minlength=n_volumes)[hits]
+
+        # siibra.commons.compare_maps with the binary cube as first and the
+        # statistical map as second map. Voxels outside the union of both are
+        # zero in both maps and are left out of the sums, but not the means.
+        cube_size = np.prod(upper - lower)
+        map_size, total, squares = self.totals[hits].T
+        union = cube_size + map_size - intersection
+        mean_cube = cube_size / np.prod(self.shape)
+        mean_map = total / np.prod(self.shape)
+        covariance = (map_sum - mean_map * cube_size - mean_cube * total
+                      + union * mean_cube * mean_map)
+        variance_cube = (cube_size * (1 - mean_cube) ** 2
+                         + (map_size - intersection) * mean_cube ** 2)
+        variance_map = squares - 2 * mean_map * total + union * mean_map ** 2
+        denominator = np.sqrt(variance_cube * variance_map)
+        correlation = np.divide(
+            covariance, denominator, out=np.zeros_like(covariance),
+            where=denominator > 0)
+
+        centroid = tuple(point.coordinate)
+        assignments = pd.DataFrame([
+            {'input structure': 0, 'centroid': centroid,
+             'volume': int(volume), 'fragment': None,
+             'region': self.get_region(int(volume)),
+             'correlation': correlation[i],
+             'intersection over union': intersection[i] / union[i],
+             'map value': None,
+             'map weighted mean': map_sum[i] / total[i],
+             'map containedness': intersection[i] / cube_size,
+             'input weighted mean': map_sum[i] / cube_size,
+             'input containedness': intersection[i] / map_size[i]}
+            for i, volume in enumerate(hits)])
+        return assignments.convert_dtypes().reindex(
+            columns=ASSIGNMENT_COLUMNS)
+
+
+def split_assignments(assignments, num_points):
+    """Split the assignments of a point set into the assignments of each
+    point.
+
+    :param pandas.DataFrame assignments: assignments with the index of the
+    point in the column 'input structure'
+    :param int num_points: number of points in the point set
+    :return: assignments of each point as if the point was assigned alone
+    :rtype: list
+    """
+    if assignments.empty:
+        return [pd.DataFrame(columns=ASSIGNMENT_COLUMNS)
+                for _ in range(num_points)]
+    assignments = assignments.sort_values('input structure', kind='stable')
+    bounds = np.searchsorted(
+        assignments['input structure'].to_numpy(dtype=int),
+        np.arange(num_points + 1))
+    assignments['input structure'] = 0
+    return [assignments.iloc[start:stop].reset_index(drop=True)
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def assign_pointset(pmap, points):
+    """Assign points with the same uncertainty to the regions of a
+    statistical map with a single call of siibra.
+
+    :param siibra.Map pmap: statistical map used for assignment
+    :param list points: points with the same uncertainty
+    :return: assignments of each point
+    :rtype: list
+    """
+    pointset = siibra.PointSet(
+        [point.coordinate for point in points], space=points[0].space,
+        sigma_mm=points[0].sigma)
+    return split_assignments(pmap.assign(pointset), len(points))
+
+
+def assign_points(points, pmap, voxel_index=None, progress=None,
+                  workers=assignment_workers):
+    """Assign points to the regions of a statistical map.
+
+    Identical points are assigned only once. The remaining points are
+    grouped by their uncertainty and each group is assigned in batches that
+    run in parallel threads.
+
+    :param list points: points to assign to regions
+    :param siibra.Map pmap: statistical map used for assignment
+    :param VoxelIndex voxel_index: index of the map to assign the points with
+    instead of siibra
+    :param callable progress: called with the number of points assigned in a
+    finished batch
+    :param int workers: number of threads assigning the batches
+    :return: assignments of each point
+    :rtype: list
+    """
+    def get_key(point):
+        return tuple(point.coordinate), point.sigma
+
+    counts = Counter(get_key(point) for point in points)
+    groups = {}
+    for point in {get_key(point): point for point in points}.values():
+        groups.setdefault(point.sigma, []).append(point)
+    # Split large groups so that all workers are busy.
+    batches = []
+    for group in groups.values():
+        size = -(-len(group) // workers)
+        batches += [group[i:i + size] for i in range(0, len(group), size)]
+
+    def assign(batch):
+        if voxel_index:
+            return voxel_index.assign_batch(batch)
+        return assign_pointset(pmap, batch)
+
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        jobs = {executor.submit(assign, batch): batch for batch in batches}
+        for job in as_completed(jobs):
+            for point, assignment in zip(jobs[job], job.result()):
+                results[get_key(point)] = assignment
+            if progress:
+                progress(sum(counts[get_key(point)] for point in jobs[job]))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return [results[get_key(point)] for point in points]
+
+
+class MapCache:
+    """Least recently used cache of statistical maps and their voxel indices
+
+    The indices are held in memory up to a budget in bytes. Maps are loaded
+    only once even if they are requested from multiple threads at the same
+    time.
+    """
+
+    def __init__(self, budget=map_cache_budget):
+        """Initialize the cache.
+
+        :param int budget: maximum size in bytes of the cached indices
+        """
+        self.budget = budget
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__key_locks = {}
+
+    @staticmethod
+    def get_key(parcellation, space, maptype):
+        """Return the key of a map in the cache.
+
+        :param siibra.Parcellation parcellation: parcellation of the map or its
+        name
+        :param siibra.Space space: space of the map or its name
+        :param str maptype: type of the map
+        :return: key of the map
+        :rtype: tuple
+        """
+        if isinstance(parcellation, str):
+            parcellation = siibra.parcellations[parcellation]
+        if isinstance(space, str):
+            space = siibra.spaces[space]
+        return parcellation.id, space.id, str(maptype).lower()
+
+    def get(self, parcellation, space, maptype='statistical'):
+        """Return a map and its voxel index and load them if necessary.
+
+        :param siibra.Parcellation parcellation: parcellation of the map
+        :param siibra.Space space: space of the map
+        :param str maptype: type of the map
+        :return: map and its voxel index or None if no index is available
+        :rtype: siibra.Map, VoxelIndex
+        """
+        key = self.get_key(parcellation, space, maptype)
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                return self.__entries[key]
+            key_lock = self.__key_locks.setdefault(key, threading.Lock())
+
+        # Load outside the cache lock so that other maps can be read
+        # meanwhile. The key lock makes concurrent requests wait for the same
+        # load.
+        with key_lock:
+            with self.__lock:
+                if key in self.__entries:
+                    self.__entries.move_to_end(key)
+                    return self.__entries[key]
+            entry = self.__load(parcellation, space, maptype)
+            with self.__lock:
+                self.__entries[key] = entry
+                self.__evict()
+        return entry
+
+    def prefetch(self, parcellation, space, maptype='statistical'):
+        """Load a map and its voxel index in a background thread.
+
+        :param siibra.Parcellation parcellation: parcellation of the map
+        :param siibra.Space space: space of the map
+        :param str maptype: type of the map
+        """
+        def run():
+            try:
+                self.get(parcellation, space, maptype)
+            except Exception as e:
+                logging.getLogger(mriwarp_name).warning(
+                    f'Prefetching {parcellation} failed: {str(e)}')
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def __load(self, parcellation, space, maptype):
+        """Load a map and read its voxel index into memory.
+
+        :param siibra.Parcellation parcellation: parcellation of the map
+        :param siibra.Space space: space of the map
+        :param str maptype: type of the map
+        :return: map and its voxel index or None if no index is available
+        :rtype: siibra.Map, VoxelIndex
+        """
+        logging.getLogger(mriwarp_name).info(
+            f'Loading {maptype} map of {parcellation}')
+        pmap = siibra.get_map(
+            parcellation=parcellation, space=space, maptype=maptype)
+        voxel_index = None
+        if use_voxel_index:
+            try:
+                voxel_index = VoxelIndex.load(pmap, mmap=False)
+            except NotImplementedError as e:
+                logging.getLogger(mriwarp_name).warning(
+                    f'Using siibra for assignment: {str(e)}')
+        return pmap, voxel_index
+
+    def __evict(self):
+        """Remove the least recently used entries until the cache fits into
+        the budget. The most recent entry is always kept.
+        """
+        def size(entry):
+            return entry[1].nbytes if entry[1] else 0
+
+        total = sum(size(entry) for entry in self.__entries.values())
+        while total > self.budget and len(self.__entries) > 1:
+            key, entry = self.__entries.popitem(last=False)
+            total -= size(entry)
+            logging.getLogger(mriwarp_name).info(
+                f'Removed map {key[0]} from the cache')
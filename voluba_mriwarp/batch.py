@@ -0,0 +1,322 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from voluba_mriwarp.cache import evict_reoriented
+from voluba_mriwarp.config import *
+from voluba_mriwarp.logic import Logic
+
+
+def collect_subjects(source, points=None):
+    """Collect the subjects to process from a folder or a manifest.
+
+    A manifest is a CSV file with an ``input`` column holding the paths to the
+    input NIfTIs and an optional ``points`` column holding the paths to point
+    CSVs. Relative paths are resolved relative to the manifest.
+
+    :param str source: folder containing NIfTIs or path to a manifest CSV
+    :param str points: point CSV used for subjects without own points
+    :return: list of (input NIfTI, point CSV) tuples
+    :rtype: list
+    :raise ValueError: if the source is neither a folder nor a manifest
+    """
+    if os.path.isdir(source):
+        inputs = sorted(
+            os.path.join(source, filename) for filename in os.listdir(source)
+            if filename.endswith('.nii') or filename.endswith('.nii.gz'))
+        return [(os.path.normpath(path), points) for path in inputs]
+
+    if not os.path.isfile(source) or not source.endswith('.csv'):
+        raise ValueError(f'{source} is neither a folder nor a manifest CSV.')
+
+    manifest = pd.read_csv(source)
+    if 'input' not in manifest.columns:
+        raise ValueError(f'{source} has no "input" column.')
+    root = os.path.dirname(os.path.abspath(source))
+
+    def resolve(path):
+        if pd.isna(path) or not str(path).strip():
+            return None
+        return os.path.normpath(os.path.join(root, str(path).strip()))
+
+    subjects = []
+    for _, row in manifest.iterrows():
+        subject_points = resolve(row['points']) \
+            if 'points' in manifest.columns else None
+        subjects.append((resolve(row['input']), subject_points or points))
+    return subjects
+
+
+def subject_folders(subjects, out_path):
+    """Return the output folders of the subjects.
+
+    The folder structure of the inputs below their common folder is kept, so
+    that subjects with the same file name in different folders (e.g.
+    sub-01/anat/T1w.nii.gz and sub-02/anat/T1w.nii.gz) do not overwrite each
+    other's results.
+
+    :param list subjects: list of (input NIfTI, point CSV) tuples
+    :param str out_path: output folder for all subjects
+    :return: output folder of each subject
+    :rtype: list
+    :raise ValueError: if two subjects would share an output folder
+    """
+    folders = [os.path.dirname(os.path.abspath(in_path))
+               for in_path, _ in subjects]
+    root = os.path.commonpath(folders) if folders else ''
+    subject_paths = []
+    for (in_path, _), folder in zip(subjects, folders):
+        filename = os.path.basename(in_path)
+        name = filename.split('.nii.gz')[0] if filename.endswith('.nii.gz') \
+            else filename.split('.nii')[0]
+        subject_paths.append(os.path.normpath(os.path.join(
+            out_path, os.path.relpath(folder, root), name)))
+
+    duplicates = sorted({path for path in subject_paths
+                         if subject_paths.count(path) > 1})
+    if duplicates:
+        raise ValueError(
+            f'Multiple subjects would write to {", ".join(duplicates)}.')
+    return subject_paths
+
+
+def read_points(path):
+    """Read points in subject's physical space (RAS) from a CSV.
+
+    The CSV needs the columns ``R``, ``A`` and ``S`` and may have a ``label``
+    column.
+
+    :param str path: path to the point CSV
+    :return: list of (label, point) tuples
+    :rtype: list
+    """
+    points = pd.read_csv(path)
+    labels = points['label'].astype(str) if 'label' in points.columns \
+        else [str(i + 1) for i in range(len(points))]
+    return list(zip(labels, points[['R', 'A', 'S']].to_numpy(dtype=float)))
+
+
+def run_subject(in_path, points_path, subject_path, parameter_path,
+                parcellation, uncertainty):
+    """Run skull stripping, registration and region assignment for one
+    subject.
+
+    Each subject uses its own Logic instance so that no state is shared
+    between subjects.
+
+    :param str in_path: path to the input NIfTI
+    :param str points_path: path to a point CSV or None
+    :param str subject_path: output folder of the subject
+    :param str parameter_path: path to the parameter JSON
+    :param str parcellation: parcellation used for region assignment
+    :param float uncertainty: uncertainty in mm of the points
+    :return: summary of the run
+    :rtype: dict
+    """
+    start = time.time()
+    summary = {'input': in_path, 'subject': '', 'status': 'failed',
+               'stage': 'setup', 'error': '', 'points': 0, 'seconds': 0.0}
+    logger = logging.getLogger(mriwarp_name)
+    handler = None
+
+    try:
+        logic = Logic()
+        logic.set_in_path(in_path)
+        summary['subject'] = logic.get_name()
+
+        # Write each subject's outputs and log to a separate folder.
+        os.makedirs(subject_path, exist_ok=True)
+        handler = logging.FileHandler(
+            os.path.join(subject_path, f'{logic.get_name()}.log'), mode='w')
+        handler.setFormatter(logging.Formatter(
+            '[%(name)s:%(levelname)s] %(asctime)s %(message)s',
+            datefmt='%d/%m/%Y %H:%M:%S'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+        logic.set_out_path(subject_path)
+        logic.set_parameters_path(parameter_path)
+        logic.save_paths()
+
+        summary['stage'] = 'skull stripping'
+        logger.info(f'Performing skull stripping for {in_path}')
+        logic.strip_skull()
+
+        summary['stage'] = 'registration'
+        logger.info(f'Performing registration for {in_path}')
+        logic.warp()
+
+        if points_path:
+            summary['stage'] = 'assignment'
+            logger.info(f'Assigning regions for {in_path}')
+            logic.set_img_type('unaligned')
+            logic.set_parcellation(parcellation)
+            tables = []
+            for label, point in read_points(points_path):
+                source, target, results = logic.assign_regions2point(
+                    logic.warp_phys2vox(point), uncertainty)
+                results = results.copy()
+                results['region'] = [region.name for region in results.region]
+                results.insert(0, 'label', label)
+                for i, axis in enumerate(['R', 'A', 'S']):
+                    results.insert(1 + i, axis, source[i])
+                for i, axis in enumerate(['MNI x', 'MNI y', 'MNI z']):
+                    results.insert(4 + i, axis, target[i])
+                tables.append(results)
+            if tables:
+                pd.concat(tables).to_csv(
+                    os.path.join(
+                        subject_path, f'{logic.get_name()}_assignments.csv'),
+                    index=False)
+            summary['points'] = len(tables)
+
+        summary['status'] = 'finished'
+        summary['stage'] = ''
+    except Exception as e:
+        logger.error(f'Error during {summary["stage"]}: {str(e)}')
+        summary['error'] = str(e)
+    finally:
+        if handler:
+            logger.removeHandler(handler)
+            handler.close()
+
+    summary['seconds'] = round(time.time() - start, 1)
+    return summary
+
+
+def run_batch(subjects, out_path, parameter_path, parcellation='julich 3.0',
+              uncertainty=0.0, workers=1):
+    """Process multiple subjects in a process pool.
+
+    :param list subjects: list of (input NIfTI, point CSV) tuples
+    :param str out_path: output folder for all subjects
+    :param str parameter_path: path to the parameter JSON
+    :param str parcellation: parcellation used for region assignment
+    :param float uncertainty: uncertainty in mm of the points
+    :param int workers: number of subjects to process in parallel
+    :return: summary of all runs
+    :rtype: pandas.DataFrame
+    :raise ValueError: if two subjects would share an output folder
+    """
+    logger = logging.getLogger(mriwarp_name)
+    subject_paths = subject_folders(subjects, out_path)
+
+    # Download HD-BET parameters once instead of in every worker.
+    from HD_BET.utils import maybe_download_parameters
+    maybe_download_parameters(0)
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                run_subject, in_path, points_path, subject_path,
+                parameter_path, parcellation, uncertainty): in_path
+            for (in_path, points_path), subject_path
+            in zip(subjects, subject_paths)}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:
+                # e.g. BrokenProcessPool if a worker crashed
+                logger.error(f'{futures[future]}: worker failed: {str(e)}')
+                summary = {'input': futures[future], 'subject': '',
+                           'status': 'failed', 'stage': 'worker',
+                           'error': str(e) or type(e).__name__,
+                           'points': 0, 'seconds': 0.0}
+            logger.info(
+                f'{summary["input"]}: {summary["status"]} '
+                f'after {summary["seconds"]} s')
+            summaries.append(summary)
+
+    # Evict the reoriented inputs only after all runs finished, as the
+    # workers read them until the end of the registration.
+    evict_reoriented()
+
+    summary = pd.DataFrame(
+        summaries, columns=['subject', 'input', 'status', 'stage', 'error',
+                            'points', 'seconds'])
+    summary = summary.sort_values(by='input')
+    summary.to_csv(os.path.join(out_path, 'summary.csv'), index=False)
+    return summary
+
+
+def main(args=None):
+    """Run the batch command.
+
+    :param list args: command line arguments, defaults to sys.argv[1:]
+    :return: exit code
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(
+        prog=f'{mriwarp_name} batch',
+        description='Warp a folder of NIfTIs to MNI152 space and assign '
+                    'regions to points without the GUI.')
+    parser.add_argument(
+        'input', help='folder containing NIfTIs or manifest CSV with an '
+                      '"input" and an optional "points" column')
+    parser.add_argument(
+        '-o', '--output', default=mriwarp_home,
+        help='output folder (default: %(default)s)')
+    parser.add_argument(
+        '-p', '--parameters',
+        default=os.path.normpath('./data/parameters/default.json'),
+        help='parameter JSON for antsRegistration (default: %(default)s)')
+    parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help='number of subjects to process in parallel (default: '
+             '%(default)s)')
+    parser.add_argument(
+        '--points',
+        help='CSV with R, A, S (and label) columns of points in subject '
+             'space to assign regions to')
+    parser.add_argument(
+        '--parcellation', default='julich 3.0',
+        help='parcellation used for region assignment (default: '
+             '%(default)s)')
+    parser.add_argument(
+        '--uncertainty', type=float, default=0.0,
+        help='uncertainty of the points in mm (default: %(default)s)')
+    args = parser.parse_args(args)
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        format='[%(name)s:%(levelname)s] %(asctime)s %(message)s',
+        datefmt='%d/%m/%Y %H:%M:%S', level=logging.INFO)
+    logger = logging.getLogger(mriwarp_name)
+
+    # Check the arguments before starting any computation.
+    logic = Logic()
+    try:
+        if args.output == mriwarp_home:
+            os.makedirs(mriwarp_home, exist_ok=True)
+        logic.set_out_path(args.output)
+        logic.set_parameters_path(args.parameters)
+        subjects = collect_subjects(args.input, args.points)
+        subject_folders(subjects, args.output)
+    except ValueError as e:
+        logger.error(str(e).rstrip())
+        return 1
+    if not subjects:
+        logger.error(f'No NIfTI files found in {args.input}.')
+        return 1
+
+    logger.info(f'Processing {len(subjects)} subjects with '
+                f'{args.workers} workers')
+    summary = run_batch(
+        subjects, args.output, args.parameters,
+        parcellation=args.parcellation, uncertainty=args.uncertainty,
+        workers=args.workers)
+    failed = (summary.status != 'finished').sum()
+    logger.info(f'Finished {len(summary) - failed} of {len(summary)} '
+                f'subjects. Summary written to '
+                f'{os.path.join(args.output, "summary.csv")}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,373 @@
+import functools
+import hashlib
+import importlib.metadata
+import glob
+import json
+import os
+import shutil
+import subprocess
+
+import nibabel as nib
+
+from voluba_mriwarp.config import (cache_home, render_cache_budget,
+                                   reoriented_cache_budget)
+
+_file_hashes = {}
+
+
+def hash_file(path, chunk_size=2**20):
+    """Return the SHA-1 hash of the content of a file.
+
+    Hashes are remembered per path, size and modification time, so unchanged
+    files are only read once per session.
+
+    :param str path: path to the file
+    :param int chunk_size: number of bytes to read at once
+    :return: hexadecimal hash
+    :rtype: str
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                sha1.update(chunk)
+        _file_hashes[key] = sha1.hexdigest()
+    return _file_hashes[key]
+
+
+def save_reoriented(image, in_path, name):
+    """Save the reoriented input NIfTI to the cache if it is not cached yet.
+
+    The file is uncompressed to avoid slow gzip compression and is keyed by
+    the content of the input file, as the image is always in canonical (RAS)
+    orientation. The file is used until the registration finished, so it is 
+    not evicted here but by evict_reoriented once no run is active.
+
+    :param nibabel.Nifti1Image image: input NIfTI in canonical orientation
+    :param str in_path: path to the input NIfTI
+    :param str name: name of the input NIfTI without the file extension
+    :return: path to the cached reoriented NIfTI
+    :rtype: str
+    """
+    key = hash_file(in_path)
+    folder = os.path.join(cache_home, 'reoriented')
+    path = os.path.join(folder, f'{name}_{key[:16]}_reorient.nii')
+
+    if os.path.exists(path):
+        # Mark the file as recently used for eviction.
+        os.utime(path)
+    else:
+        os.makedirs(folder, exist_ok=True)
+        # Write to a temporary file first so that an interrupted write is not
+        # mistaken for a cached file.
+        tmp_path = os.path.join(folder, f'{key}_{os.getpid()}.part.nii')
+        nib.save(image, tmp_path)
+        os.replace(tmp_path, path)
+    return path
+
+
+def evict_reoriented(budget=reoriented_cache_budget):
+    """Remove the least recently used reoriented input NIfTIs until they fit
+    into the budget.
+
+    Only call this while no skull stripping or registration is running, as
+    the runs read their reoriented input until they are finished.
+
+    :param int budget: maximum size in bytes of the cached reoriented NIfTIs
+    """
+    evict_files(os.path.join(cache_home, 'reoriented', '*_reorient.nii'),
+                budget)
+
+
+def evict_files(pattern, budget, keep=None):
+    """Remove the least recently used files matching a pattern until they fit
+    into the budget.
+
+    :param str pattern: glob pattern of the cached files
+    :param int budget: maximum size in bytes of the files
+    :param str keep: path to a file that is never removed
+    """
+    files = []
+    total = 0
+    for path in glob.glob(pattern):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, path, stat.st_size))
+        total += stat.st_size
+
+    for _, path, size in sorted(files):
+        if total <= budget:
+            break
+        if keep and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            # The file may be in use by another process.
+            continue
+        total -= size
+
+
+class ResultManifest:
+    """Manifest of skull stripping and registration results in an output 
+    folder"""
+
+    def __init__(self, out_path, name):
+        """Load the manifest of a subject if it exists.
+
+        :param str out_path: output folder of the results
+        :param str name: name of the input NIfTI without the file extension
+        """
+        self.__out_path = out_path
+        self.path = os.path.join(out_path, f'{name}_manifest.json')
+        self.__manifest = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as file:
+                    self.__manifest = json.load(file)
+            except (OSError, ValueError):
+                self.__manifest = {}
+
+    def exists(self):
+        """Return True if a manifest was written for the subject."""
+        return bool(self.__manifest)
+
+    def matches_input(self, in_path):
+        """Check if the results were computed for the given input NIfTI.
+
+        :param str in_path: path to the input NIfTI
+        :return: True if the recorded input matches, False otherwise.
+        :rtype: bool
+        """
+        record = self.__manifest.get('input')
+        if not record:
+            return False
+        stat = os.stat(in_path)
+        # Only hash the input if it was touched since the last run.
+        if record['size'] == stat.st_size \
+                and record['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        return record['hash'] == hash_file(in_path)
+
+    def is_current(self, stage, key):
+        """Check if the results of a stage are up to date.
+
+        :param str stage: name of the stage
+        :param str key: hash of all inputs of the stage
+        :return: True if the stage was run with the same inputs and its outputs
+        are unchanged, False otherwise.
+        :rtype: bool
+        """
+        record = self.__manifest.get('stages', {}).get(stage)
+        if not record or record['key'] != key:
+            return False
+        return all(self.__is_unchanged(filename, output)
+                   for filename, output in record['outputs'].items())
+
+    def owns(self, path):
+        """Check if a file is an unchanged output of any recorded stage.
+
+        :param str path: path to the file
+        :return: True if the file is a recorded output, False otherwise.
+        :rtype: bool
+        """
+        filename = os.path.basename(path)
+        for record in self.__manifest.get('stages', {}).values():
+            if filename in record['outputs']:
+                return self.__is_unchanged(
+                    filename, record['outputs'][filename])
+        return False
+
+    def update(self, stage, key, in_path, outputs):
+        """Record the results of a stage and write the manifest.
+
+        :param str stage: name of the stage
+        :param str key: hash of all inputs of the stage
+        :param str in_path: path to the input NIfTI
+        :param list outputs: paths to the output files of the stage
+        """
+        stat = os.stat(in_path)
+        self.__manifest['input'] = {
+            'path': os.path.abspath(in_path), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns, 'hash': hash_file(in_path)}
+        records = {}
+        for output in outputs:
+            stat = os.stat(output)
+            records[os.path.basename(output)] = {
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        self.__manifest.setdefault('stages', {})[stage] = {
+            'key': key, 'outputs': records}
+
+        with open(self.path, 'w') as file:
+            json.dump(self.__manifest, file, indent=4)
+
+    def __is_unchanged(self, filename, record):
+        """Check if an output file still has the recorded size and 
+        modification time.
+
+        :param str filename: name of the output file
+        :param dict record: recorded size and modification time
+        :return: True if the file is unchanged, False otherwise.
+        :rtype: bool
+        """
+        path = os.path.join(self.__out_path, filename)
+        if not os.path.isfile(path):
+            return False
+        stat = os.stat(path)
+        return record['size'] == stat.st_size \
+            and record['mtime_ns'] == stat.st_mtime_ns
+
+
+class RenderCache:
+    """Persistent cache of rendered report figures
+
+    An entry holds all figures rendered by one plot job. It is stored as
+    <key>.json listing the figures <key>_<i>.<ext>. An empty list is a valid
+    entry, e.g. for a region without the requested feature.
+    """
+
+    def __init__(self, path=None, budget=render_cache_budget):
+        """Initialize the cache.
+
+        :param str path: folder of the cache, defaults to 
+        <cache_home>/renders
+        :param int budget: maximum size in bytes of the cached figures
+        """
+        self.path = path or os.path.join(cache_home, 'renders')
+        self.budget = budget
+
+    def get(self, *values):
+        """Return the cached figures of a plot job.
+
+        :return: paths to the figures or None if the job is not cached
+        :rtype: list
+        """
+        index = os.path.join(self.path, f'{hash_key(*values)}.json')
+        try:
+            with open(index, 'r') as file:
+                filenames = json.load(file)
+        except (OSError, ValueError):
+            return None
+        paths = [os.path.join(self.path, filename) for filename in filenames]
+        if not all(os.path.isfile(path) for path in paths):
+            return None
+        # Mark the entry as recently used for eviction.
+        os.utime(index)
+        return paths
+
+    def put(self, filenames, *values):
+        """Move the figures of a plot job to the cache.
+
+        :param list filenames: paths to the rendered figures
+        :return: paths to the cached figures
+        :rtype: list
+        """
+        key = hash_key(*values)
+        os.makedirs(self.path, exist_ok=True)
+        names = [f'{key}_{i}{os.path.splitext(filename)[1]}'
+                 for i, filename in enumerate(filenames)]
+        for filename, name in zip(filenames, names):
+            shutil.move(filename, os.path.join(self.path, name))
+
+        # Write the index last so that incomplete entries are never read.
+        index = os.path.join(self.path, f'{key}.json')
+        tmp_path = f'{index}_{os.getpid()}.part'
+        with open(tmp_path, 'w') as file:
+            json.dump(names, file)
+        os.replace(tmp_path, index)
+        return [os.path.join(self.path, name) for name in names]
+
+    def evict(self):
+        """Remove the least recently used entries until the cached figures
+        fit into the budget.
+        """
+        entries = []
+        total = 0
+        for index in glob.glob(os.path.join(self.path, '*.json')):
+            try:
+                with open(index, 'r') as file:
+                    paths = [os.path.join(self.path, filename)
+                             for filename in json.load(file)]
+                size = sum(os.path.getsize(path) for path in paths
+                           if os.path.isfile(path))
+                entries.append((os.path.getmtime(index), index, paths, size))
+            except (OSError, ValueError):
+                continue
+            total += size
+
+        for _, index, paths, size in sorted(entries):
+            if total <= self.budget:
+                break
+            for path in [index] + paths:
+                if os.path.isfile(path):
+                    os.remove(path)
+            total -= size
+
+
+def read_catalogue(key):
+    """Read the parcellations stored in the persistent catalogue.
+
+    :param str key: hash of the siibra version and the catalogue's query
+    :return: names of the parcellations or None if no catalogue for the key
+    exists
+    :rtype: list
+    """
+    path = os.path.join(cache_home, 'parcellations.json')
+    try:
+        with open(path, 'r') as file:
+            catalogue = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if catalogue.get('key') != key:
+        return None
+    return catalogue['parcellations']
+
+
+def write_catalogue(key, parcellations):
+    """Write parcellations to the persistent catalogue.
+
+    :param str key: hash of the siibra version and the catalogue's query
+    :param list parcellations: names of the parcellations
+    """
+    os.makedirs(cache_home, exist_ok=True)
+    path = os.path.join(cache_home, 'parcellations.json')
+    tmp_path = f'{path}_{os.getpid()}.part'
+    with open(tmp_path, 'w') as file:
+        json.dump({'key': key, 'parcellations': parcellations}, file,
+                  indent=4)
+    os.replace(tmp_path, path)
+
+
+def hash_key(*values):
+    """Return a hash of JSON-serializable values.
+
+    :return: hexadecimal hash
+    :rtype: str
+    """
+    return hashlib.sha1(
+        json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+@functools.lru_cache()
+def tool_versions():
+    """Return the versions of HD-BET and ANTs used for warping.
+
+    :return: versions of HD-BET and antsRegistration
+    :rtype: dict
+    """
+    try:
+        hd_bet = importlib.metadata.version('HD-BET')
+    except importlib.metadata.PackageNotFoundError:
+        hd_bet = 'unknown'
+    try:
+        ants = subprocess.run(
+            'antsRegistration --version', stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, shell=True).stdout.decode('utf-8').strip()
+        ants = ants or 'unknown'
+    except OSError:
+        ants = 'unknown'
+    return {'HD-BET': hd_bet, 'ANTs': ants}
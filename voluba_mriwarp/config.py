@@ -4,7 +4,36 @@ import os
 mriwarp_name = 'voluba-mriwarp'
 mriwarp_home = os.path.normpath(os.path.expanduser(f'~/{mriwarp_name}'))
 parameter_home = os.path.normpath(os.path.join(mriwarp_home, 'parameters'))
+cache_home = os.path.normpath(os.path.join(mriwarp_home, 'cache'))
 mni_template = os.path.normpath('./data/MNI152_stripped.nii.gz')
+# Maximum size in bytes of the reoriented inputs kept in the cache.
+reoriented_cache_budget = 2 * 2**30
+
+# region assignment
+# Look up voxel-precise assignments in a local index instead of siibra.
+use_voxel_index = True
+# Memory budget in bytes of the voxel indices kept in memory.
+map_cache_budget = 2**30
+# Number of threads assigning the points of an export.
+assignment_workers = os.cpu_count() or 1
+
+# report export
+# Number of processes rendering the plots of a report.
+report_workers = max(1, (os.cpu_count() or 1) - 1)
+# Number of points whose plots are rendered ahead of the PDF.
+report_window = 4
+# Maximum size in bytes of the cached report figures.
+render_cache_budget = 500 * 2**20
+# Resolution and image encoding of the report figures. Simple line plots
+# are embedded as vector graphics if 'vector' is set.
+quality_profiles = {
+    'draft': {'dpi': 72, 'format': 'jpeg', 'jpeg_quality': 70,
+              'colors': None, 'vector': False},
+    'screen': {'dpi': 150, 'format': 'png', 'jpeg_quality': None,
+               'colors': 256, 'vector': False},
+    'print': {'dpi': 300, 'format': 'png', 'jpeg_quality': None,
+              'colors': None, 'vector': True}
+}
 
 # colors
 siibra_bg = '#2c2c2c'
@@ -24,3 +53,25 @@ font_12_b = ('', 12, 'bold')
 font_18_b = ('', 18, 'bold')
 
 sidepanel_width = 600
+
+# viewer
+# Number of coronal slices kept as images for scrubbing.
+slice_cache_size = 32
+# Number of slices prepared in each direction around the shown slice.
+slice_prefetch = 4
+# Time in seconds one frame of the viewer should take at most.
+frame_budget = 1 / 60
+# Number of recent frame times kept for inspection.
+frame_time_samples = 120
+# PIL resampling filter of the viewer while panning, zooming or scrolling
+# through slices, and of the refined view once the interaction settled.
+interactive_filter = 'bilinear'
+settled_filter = 'lanczos'
+# Time in milliseconds without interaction until the view is refined.
+refine_delay = 150
+
+# startup
+# Time in seconds until the first window should be shown.
+startup_budget = 1.0
+# Time in seconds a region assignment waits for siibra to be loaded.
+siibra_timeout = 300
@@ -0,0 +1,98 @@
+import operator
+
+import numpy as np
+
+# comparison operators selectable for a filter condition
+OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq
+}
+
+
+class AssignmentFilter:
+    """Compound filter of region assignments
+
+    A filter is a list of conditions of the form [column, sign, value] that
+    are combined with AND or OR into one boolean mask over all assignments.
+    As before, an assignment only fulfills a condition if its value in the
+    column is set and non-zero. Optionally, only the top k remaining
+    assignments of each point are kept.
+    """
+
+    def __init__(self, conditions, combine='and', top_k=None):
+        """Initialize the filter.
+
+        :param list conditions: conditions of the form [column, sign, value]
+        :param str combine: 'and' to require all conditions, 'or' to require
+        any condition
+        :param int top_k: maximum number of assignments to keep per point,
+        keep all if None
+        :raise ValueError: if the filter is not well-formed
+        """
+        if not conditions:
+            raise ValueError('A filter needs at least one condition.')
+        for column, sign, value in conditions:
+            if sign not in OPERATORS:
+                raise ValueError(f'Unknown filter operator {sign}.')
+        if combine not in ['and', 'or']:
+            raise ValueError(f'Unknown filter combination {combine}.')
+        if top_k is not None and top_k < 1:
+            raise ValueError('The filter has to keep at least one region.')
+
+        self.conditions = [[column, sign, float(value)]
+                           for column, sign, value in conditions]
+        self.combine = combine
+        self.top_k = top_k
+
+    def __str__(self):
+        """Return a human-readable description of the filter."""
+        description = f' {self.combine} '.join(
+            f'{column} {sign} {value:g}'
+            for column, sign, value in self.conditions)
+        if self.top_k:
+            description += f' (at most {self.top_k} per point)'
+        return description
+
+    def mask(self, assignments):
+        """Compute which assignments fulfill the conditions.
+
+        :param pandas.DataFrame assignments: assignments to filter
+        :return: True for each assignment to keep
+        :rtype: numpy.ndarray
+        """
+        reduce = np.logical_and if self.combine == 'and' else np.logical_or
+        mask = np.full(len(assignments), self.combine == 'and')
+        for column, sign, value in self.conditions:
+            # Missing values (pd.NA) become NaN and never match.
+            values = assignments[column].to_numpy(
+                dtype=float, na_value=np.nan)
+            mask = reduce(mask, (values != 0) & ~np.isnan(values)
+                          & OPERATORS[sign](values, value))
+        return mask
+
+    def apply(self, assignments, sort_by=None):
+        """Filter the assignments of all points at once.
+
+        :param pandas.DataFrame assignments: assignments with the point index
+        as the first index level 'point'
+        :param str sort_by: column to rank the assignments of a point by, 
+        defaults to 'correlation' or to 'map value' if no correlation is set 
+        (assignments without uncertainty)
+        :return: filtered assignments sorted by point and sort_by
+        :rtype: pandas.DataFrame
+        """
+        if sort_by is None:
+            sort_by = 'correlation'
+            if 'correlation' not in assignments.columns \
+                    or assignments['correlation'].isna().all():
+                sort_by = 'map value'
+        filtered = assignments[self.mask(assignments)]
+        filtered = filtered.sort_values(
+            by=['point', sort_by], ascending=[True, False], kind='stable')
+        if self.top_k:
+            filtered = filtered.groupby(level='point', sort=False).head(
+                self.top_k)
+        return filtered
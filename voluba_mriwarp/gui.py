@@ -11,6 +11,7 @@ from PIL import Image
 from PIL.ImageTk import PhotoImage
 from tkfontawesome import icon_to_image
 
+from voluba_mriwarp.cache import evict_reoriented
 from voluba_mriwarp.config import *
 from voluba_mriwarp.exceptions import *
 from voluba_mriwarp.logic import Logic
@@ -21,9 +22,16 @@ from voluba_mriwarp.widgets import *
 class App(tk.Tk):
     """GUI window"""
 
-    def __init__(self):
-        """Initialize the window."""
+    def __init__(self, start_time=None):
+        """Initialize the window.
+
+        :param float start_time: time.perf_counter() at application start to
+        measure the startup time
+        """
         super().__init__(className=mriwarp_name)
+        self.__start_time = start_time
+        # time in seconds until the first window was shown
+        self.startup_time = None
 
         self.title(mriwarp_name)
         self.iconphoto(True, PhotoImage(Image.open(mriwarp_icon)))
@@ -33,6 +41,7 @@ class App(tk.Tk):
         self.__create_logic()
         self.__create_preload_window()
         self.__create_main_window()
+        self.__start_warmup()
 
         self.mainloop()
 
@@ -63,9 +72,15 @@ class App(tk.Tk):
         """Create the instances for the logical backend."""
         self.logic = Logic()
         self.__annotation = (-1, -1, -1)
+        self.__warmed_up = set()
+        self.__siibra_ready = threading.Event()
+        # error message if siibra could not be loaded in the background
+        self.__siibra_error = None
 
     def __create_preload_window(self):
-        """Create the widgets for preloading siibra components."""
+        """Create the widgets for preloading the components needed by the main
+        window.
+        """
         self.configure(bg=siibra_bg)
         self.resizable(False, False)
 
@@ -82,21 +97,132 @@ class App(tk.Tk):
         label.pack(padx=10, pady=5)
         label = tk.Label(
             self,
-            text='Loading siibra components. This may take a few minutes.',
-            bg=siibra_bg, fg=siibra_fg)
+            text='Loading components.', bg=siibra_bg, fg=siibra_fg)
         label.pack(padx=10, pady=5)
 
-        # Preload probability maps to speed up region assignment.
-        thread = threading.Thread(target=self.logic.preload, daemon=True)
-        thread.start()
-
-        # Threading is needed because the window cannot be closed otherwise.
-        while thread.is_alive():
-            self.update()
+        # progress of each preload task
+        tasks = {'parameters': 'Warping parameters',
+                 'template': 'MNI152 template'}
+        states = {name: 'waiting' for name in tasks}
+        progress = {}
+        for name, text in tasks.items():
+            progress[name] = tk.StringVar(value=f'{text}: waiting')
+            label = tk.Label(self, textvariable=progress[name], bg=siibra_bg,
+                             fg=siibra_fg, font=font_10)
+            label.pack(padx=10)
+        self.update()
+        self.__log_startup_time()
+
+        def set_state(name, state):
+            # Called from the preload threads. The labels are updated by the
+            # main thread below as Tk is not thread-safe.
+            states[name] = state
+
+        while True:
+            failed = []
+            thread = threading.Thread(
+                target=lambda: failed.extend(
+                    self.logic.preload(set_state, tasks=list(tasks))),
+                daemon=True)
+            thread.start()
+
+            # Threading is needed because the window cannot be closed 
+            # otherwise.
+            while thread.is_alive():
+                for name, text in tasks.items():
+                    progress[name].set(f'{text}: {states[name]}')
+                self.update()
+                time.sleep(0.01)
+            for name, text in tasks.items():
+                progress[name].set(f'{text}: {states[name]}')
+
+            # Only rerun the failed tasks.
+            if not failed or not messagebox.askretrycancel(
+                    'Error',
+                    f'Loading {", ".join(tasks[name] for name in failed)} '
+                    f'failed. See the log for details.'):
+                break
 
         for widget in self.winfo_children():
             widget.destroy()
 
+    def __log_startup_time(self):
+        """Log the time until the first window was shown."""
+        if self.__start_time is None:
+            return
+        startup_time = time.perf_counter() - self.__start_time
+        self.startup_time = startup_time
+        logger = logging.getLogger(mriwarp_name)
+        if startup_time > startup_budget:
+            logger.warning(f'First window shown after {startup_time:.2f} s '
+                           f'(budget {startup_budget:.2f} s)')
+        else:
+            logger.info(f'First window shown after {startup_time:.2f} s')
+
+    def __start_warmup(self):
+        """Load HD-BET and siibra in the background.
+
+        Warping and region assignment are enabled as soon as their components
+        are loaded.
+        """
+        tasks = {'HD-BET': 'HD-BET parameters',
+                 'parcellations': 'siibra parcellations'}
+        states = {name: 'waiting' for name in tasks}
+        failed = []
+
+        def set_state(name, state):
+            # Called from the preload threads. The widgets are updated by the
+            # main thread in __poll_warmup as Tk is not thread-safe.
+            states[name] = state
+
+        thread = threading.Thread(
+            target=lambda: failed.extend(
+                self.logic.preload(set_state, tasks=list(tasks))),
+            daemon=True)
+        thread.start()
+        self.__poll_warmup(thread, tasks, states, failed)
+
+    def __poll_warmup(self, thread, tasks, states, failed):
+        """Enable the widgets of finished warm-up tasks.
+
+        :param threading.Thread thread: thread running the warm-up
+        :param dict tasks: names and descriptions of the warm-up tasks
+        :param dict states: current state of each task
+        :param list failed: names of the tasks that failed
+        """
+        for name, state in states.items():
+            if state != 'finished' or name in self.__warmed_up:
+                continue
+            self.__warmed_up.add(name)
+            if name == 'HD-BET':
+                self.__warp_button.configure(
+                    text='Warp input to MNI152 space', state='normal')
+            elif name == 'parcellations':
+                self.__parcellation_options.set_menu(
+                    self.logic.get_parcellation(),
+                    *self.logic.get_parcellations())
+                self.__analysis_button.configure(
+                    text=' Analysis', state='normal')
+                self.__siibra_ready.set()
+
+        if thread.is_alive():
+            self.after(100, self.__poll_warmup, thread, tasks, states, failed)
+            return
+
+        if 'parcellations' in failed:
+            # Release region assignments waiting for siibra.
+            self.__siibra_error = 'Loading the siibra parcellations failed.'
+            self.__siibra_ready.set()
+        if failed and messagebox.askretrycancel(
+                'Error',
+                f'Loading {", ".join(tasks[name] for name in failed)} '
+                f'failed. See the log for details.'):
+            if 'parcellations' in failed:
+                self.__siibra_error = None
+                self.__siibra_ready.clear()
+            # Only the failed tasks are run again.
+            self.__start_warmup()
+
     def __create_main_window(self):
         """Create the widgets for the main window."""
         self.resizable(True, True)
@@ -157,12 +283,13 @@ class App(tk.Tk):
             command=self.__show_warping_frame, indicatoron=0,
             selectcolor=siibra_highlight_bg, bd=0, width=20)
         radio_button.grid(column=0, row=0, pady=(20, 0))
-        radio_button = tk.Radiobutton(
-            self.__menu, text=' Analysis', font=font_10_b,
+        # Analysis is enabled once siibra is loaded.
+        self.__analysis_button = tk.Radiobutton(
+            self.__menu, text=' Analysis (loading)', font=font_10_b,
             bg=siibra_bg, fg='white', variable=self.__step, value=1,
             command=self.__show_assignment_frame, indicatoron=0,
-            selectcolor=siibra_highlight_bg, bd=0, width=20)
-        radio_button.grid(column=1, row=0, pady=(20, 0))
+            selectcolor=siibra_highlight_bg, bd=0, width=20, state='disabled')
+        self.__analysis_button.grid(column=1, row=0, pady=(20, 0))
 
         # frame for warping
         self.__warping_frame = tk.Frame(
@@ -260,9 +387,10 @@ class App(tk.Tk):
         self.__json_showing = False
 
         # widgets for warping to MNI152
+        # Warping is enabled once the HD-BET parameters are downloaded.
         self.__warp_button = tk.Button(
-            self.__warping_frame, text='Warp input to MNI152 space',
-            command=self.__prepare_warping, bd=0)
+            self.__warping_frame, text='Loading HD-BET parameters...',
+            command=self.__prepare_warping, bd=0, state='disabled')
         self.__warp_button.pack(fill='x', padx=15, pady=(15, 20))
         self.__check_mark = None
 
@@ -305,13 +433,14 @@ class App(tk.Tk):
             parcellation_frame, text='Parcellation:', justify='left',
             bg=siibra_highlight_bg, fg='white', anchor='w', width=15)
         label.grid(column=0, row=0, sticky='w')
+        # The parcellations are filled in once siibra is loaded.
         parcellation = tk.StringVar()
-        parcellation_options = ttk.OptionMenu(
-            parcellation_frame, parcellation, self.logic.get_parcellation(),
-            *self.logic.get_parcellations(),
+        self.__parcellation_options = ttk.OptionMenu(
+            parcellation_frame, parcellation, 'Loading...',
             command=self.__change_parcellation)
-        parcellation_options.configure(width=40)
-        parcellation_options.grid(column=1, row=0, sticky='we', padx=10)
+        self.__parcellation_options.configure(width=40)
+        self.__parcellation_options.grid(
+            column=1, row=0, sticky='we', padx=10)
 
         # widgets for point uncertainty
         uncertainty_frame = tk.Frame(
@@ -475,7 +604,7 @@ class App(tk.Tk):
         # View needs to be initialized before slider as slider.set updates the
         # viewer.
         self.__coronal_viewer = Viewer(
-            self.__view_panel, image=image[:, coronal_slice, :],
+            self.__view_panel, volume=image, slice=coronal_slice,
             side='bottom', padx=10, pady=10)
 
         # help icon
@@ -521,8 +650,7 @@ class App(tk.Tk):
 
         :param int value: slice of the input NIfTI to display
         """
-        self.__coronal_viewer.update_image(self.logic.get_numpy_source()[
-            :, int(value) - 1, :], int(value) - 1)
+        self.__coronal_viewer.update_image(int(value) - 1)
 
     def __validate_float(self, value):
         """Validate if the entered value is a numerical value.
@@ -710,6 +838,8 @@ class App(tk.Tk):
             messagebox.showerror('Error', str(e))
             return
 
+        # No run is active as the warp button is disabled during warping.
+        evict_reoriented()
         self.logic.save_paths()
 
         # During warping the button is disabled to prevent multiple starts.
@@ -909,10 +1039,30 @@ class App(tk.Tk):
         self.__calculating = True
         threading.Thread(target=self.__show_wip, daemon=True).start()
 
+        # Wait until siibra is loaded if a point is selected during startup.
+        if not self.__siibra_ready.wait(timeout=siibra_timeout):
+            error = f'siibra was not loaded within {siibra_timeout} s.'
+        else:
+            error = self.__siibra_error
+        if error:
+            logging.getLogger(mriwarp_name).error(
+                f'Error during region calculation: {error}')
+            messagebox.showerror(
+                'Error',
+                f'The following error occurred during region calculation:'
+                f'\n\n{error}\n\n'
+                f'If you need help, please contact support@ebrains.eu.')
+            label = tk.Label(
+                self.__region_frame, text='No region found', font=font_10_b,
+                bg='red', fg='black', borderwidth=10, anchor='w')
+            label.pack(fill='x')
+            self.__calculating = False
+            return
+
         # Assign regions.
         uncertainty = self.__uncertainty.get()
         try:
-            source, target, results, urls = self.logic.assign_regions2point(
+            source, target, results = self.logic.assign_regions2point(
                 self.__annotation, float(uncertainty))
         except SubprocessFailedError as e:
             logging.getLogger(mriwarp_name).error(
@@ -1003,8 +1153,12 @@ class App(tk.Tk):
             columns = results.columns.values.tolist()
             tree = customTreeView(
                 region_frame, columns=columns, show='headings')
-            tree.bind('<Double-1>', lambda event,
-                      _urls=urls: tree.open_url(event, _urls))
+            # Urls are built on double-click for the parcellation the
+            # regions were assigned to.
+            parcellation = self.logic.get_parcellation()
+            tree.bind('<Double-1>', lambda event: tree.open_url(
+                event, lambda region: self.logic.get_url(
+                    region, parcellation)))
 
             y_scrollbar = tk.Scrollbar(
                 region_frame, orient='vertical', command=tree.yview)
@@ -1070,7 +1224,7 @@ class App(tk.Tk):
         ) == mni_template else 'aligned' if self.__mni.get() == 1 else 'unaligned'
         self.logic.set_img_type(type)
         self.logic.set_uncertainty(float(self.__uncertainty.get()))
-        ExportDialog(self, title='Export to PDF report', logic=self.logic)
+        ExportDialog(self, title='Export assignments', logic=self.logic)
 
     def __show_error(self, stage, error):
         """Stop the warping and show the error that occurred.
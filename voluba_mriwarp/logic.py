@@ -4,15 +4,15 @@ import os
 import platform
 import subprocess
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import nibabel as nib
 import numpy as np
-import pandas as pd
-import siibra
-import siibra_explorer_toolsuite
-from HD_BET.run import run_hd_bet
-from HD_BET.utils import maybe_download_parameters
 
+from voluba_mriwarp.cache import (ResultManifest, hash_file, hash_key,
+                                  read_catalogue, save_reoriented,
+                                  tool_versions, write_catalogue)
 from voluba_mriwarp.config import *
 from voluba_mriwarp.exceptions import *
 
@@ -26,6 +26,8 @@ class Logic:
         self.__in_path = ''
         self.__out_path = ''
         self.__transform_path = ''
+        self.__transform = None
+        self.__transform_key = None
         self.__name = ''
         self.__nifti_image = None
         self.__numpy_image = None
@@ -33,42 +35,100 @@ class Logic:
         self.__warping_parameters = None
         self.__error = ''
         self.__saved_points = []
+        self.__map_cache = None
+        self.__urls = {}
+        self.__mni152_parcellations = []
+        self.__preloaded = set()
 
-    def preload(self):
+    def preload(self, progress=None, tasks=None):
         """Preload HD_BET parameters, siibra and its components to speed up 
         region assignment.
+
+        The tasks are independent and run in parallel. Tasks that finished in
+        an earlier call are skipped, so a failed preload can be resumed.
+
+        :param callable progress: called with the name of a task and its state
+        ('running', 'finished' or 'failed')
+        :param list tasks: names of the tasks to run ('parameters', 'HD-BET',
+        'template' and 'parcellations'), defaults to all tasks
+        :return: names of the tasks that failed
+        :rtype: list
         """
         # Create result directory.
         if not os.path.exists(mriwarp_home):
             os.mkdir(mriwarp_home)
 
-        # Copy warping parameters.
+        all_tasks = {'parameters': self.__copy_parameters,
+                     'HD-BET': self.__download_hd_bet_parameters,
+                     'template': self.__load_template,
+                     'parcellations': self.__load_parcellations}
+        tasks = {name: task for name, task in all_tasks.items()
+                 if name not in self.__preloaded
+                 and (tasks is None or name in tasks)}
+        progress = progress or (lambda name, state: None)
+
+        def run(name, task):
+            progress(name, 'running')
+            task()
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(len(tasks), 1)) as executor:
+            futures = {executor.submit(run, name, task): name
+                       for name, task in tasks.items()}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.getLogger(mriwarp_name).error(
+                        f'Preloading {name} failed: {str(e)}')
+                    failed.append(name)
+                    progress(name, 'failed')
+                else:
+                    self.__preloaded.add(name)
+                    progress(name, 'finished')
+        return failed
+
+    def __copy_parameters(self):
+        """Copy the warping parameters to the result directory."""
         if not os.path.exists(parameter_home):
             parameter_source = os.path.normpath('./data/parameters')
             if platform.system() == 'Linux':
                 os.system(f'cp -r {parameter_source} {mriwarp_home}')
             else:
                 os.system(f'xcopy {parameter_source} {parameter_home} /i')
-        
-        # Download HD-BET parameters.
+
+    def __download_hd_bet_parameters(self):
+        """Download the HD-BET parameters."""
+        from HD_BET.utils import maybe_download_parameters
+
         maybe_download_parameters(0)
 
-        # Initialize input and output.
+    def __load_template(self):
+        """Initialize input and output with the MNI152 template."""
         self.set_in_path(mni_template)
         self.set_out_path(mriwarp_home)
 
-        # Get all parcellations available for MNI152 space.
+    def __load_parcellations(self):
+        """Get all parcellations available for MNI152 space.
+
+        The parcellations are read from the persistent catalogue. Only if no
+        catalogue exists for the installed siibra version, siibra is queried.
+        """
+        import siibra
+
         mni152 = siibra.spaces.MNI_152_ICBM_2009C_NONLINEAR_ASYMMETRIC
-        
-        pmaps = siibra.maps.dataframe
-        mni_pmaps = pmaps[(pmaps.maptype == 'STATISTICAL')
-                          & (pmaps.space == mni152.name)]
-        self.__mni152_parcellations = [parcellation
-                                       for parcellation in
-                                       mni_pmaps.parcellation]
-        # Remove duplicate Julich-Brain 3.0.
-        self.__mni152_parcellations = list(dict.fromkeys(self.__mni152_parcellations))
-        
+        key = hash_key(siibra.__version__, mni152.name, 'STATISTICAL')
+        parcellations = read_catalogue(key)
+        if parcellations is None:
+            pmaps = siibra.maps.dataframe
+            mni_pmaps = pmaps[(pmaps.maptype == 'STATISTICAL')
+                              & (pmaps.space == mni152.name)]
+            # Remove duplicate Julich-Brain 3.0.
+            parcellations = list(dict.fromkeys(mni_pmaps.parcellation))
+            write_catalogue(key, parcellations)
+        self.__mni152_parcellations = parcellations
+
         self.set_parcellation('julich 3.0')
 
     def set_in_path(self, in_path):
@@ -80,9 +140,7 @@ class Logic:
         if self.check_in_path(in_path):
             self.__in_path = in_path
             self.__set_name()
-            transform_path = f'{os.path.normpath(os.path.join(self.__out_path, self.__name))}' \
-                f'_transformationInverseComposite.h5'
-            self.set_transform_path(transform_path)
+            self.__find_transform()
             self.load_source()
         else:
             raise ValueError(self.__error)
@@ -99,9 +157,7 @@ class Logic:
         """
         if self.check_out_path(out_path):
             self.__out_path = out_path
-            transform_path = f'{os.path.normpath(os.path.join(self.__out_path, self.__name))}' \
-                f'_transformationInverseComposite.h5'
-            self.set_transform_path(transform_path)
+            self.__find_transform()
         else:
             raise ValueError(self.__error)
 
@@ -121,15 +177,35 @@ class Logic:
         return self.__name
 
     def load_source(self):
-        """Load the NIfTI file and convert it to a numpy array."""
-        # Reorient NIfTI to standard orientation.
+        """Load the NIfTI file and quantize it to uint8 for display.
+
+        Uncompressed NIfTIs stay memory-mapped. Only the uint8 display volume 
+        is held in memory.
+        """
+        # Reorient NIfTI to standard orientation. Reorientation only flips 
+        # and transposes the data, so memory-mapped data is not copied.
         self.__nifti_image = nib.funcs.as_closest_canonical(
-            nib.load(self.__in_path))
-        # Rotate the image to display the correct orientation.
-        self.__numpy_image = np.rot90(
-            self.__nifti_image.get_fdata(), axes=(0, 2))
-        # Normalize values for PIL.
-        self.__numpy_image *= 255.0/self.__numpy_image.max()
+            nib.load(self.__in_path, mmap=True))
+        # For uncompressed NIfTIs without scaling this is the memory map itself.
+        data = np.asanyarray(self.__nifti_image.dataobj)
+
+        # Normalize values for PIL. Process the volume in slabs to avoid a full
+        # float copy.
+        slab = max(1, 2**22 // max(1, np.prod(data.shape[1:])))
+        maximum = max(data[i:i + slab].max()
+                      for i in range(0, data.shape[0], slab))
+        scale = np.float32(255.0 / maximum if maximum > 0 else 0.0)
+        image = np.empty(data.shape, dtype=np.uint8)
+        for i in range(0, data.shape[0], slab):
+            values = np.multiply(data[i:i + slab], scale, dtype=np.float32)
+            image[i:i + slab] = np.maximum(values, 0, out=values)
+
+        # Rotate the image to display the correct orientation and store it
+        # slice-major, so each coronal slice is one contiguous block. The
+        # returned volume is a view with the rotated axis order.
+        volume = np.ascontiguousarray(
+            np.rot90(image, axes=(0, 2)).transpose(1, 0, 2))
+        self.__numpy_image = volume.transpose(1, 0, 2)
 
     def get_nifti_source(self):
         """Return the input NIfTI as Nifti1Image"""
@@ -149,6 +225,24 @@ class Logic:
         else:
             self.__transform_path = ''
 
+    def __find_transform(self):
+        """Set the transform matrix of a previous registration in the output 
+        folder.
+        """
+        transform_path = f'{os.path.normpath(os.path.join(self.__out_path, self.__name))}' \
+            f'_transformationInverseComposite.h5'
+        # Ignore transforms that were computed for a different input or that 
+        # changed after the registration.
+        manifest = ResultManifest(self.__out_path, self.__name)
+        if manifest.exists() and os.path.isfile(transform_path) and not (
+                manifest.matches_input(self.__in_path)
+                and manifest.owns(transform_path)):
+            logging.getLogger(mriwarp_name).warning(
+                f'Ignoring {transform_path} as it does not match '
+                f'{self.__in_path}.')
+            transform_path = ''
+        self.set_transform_path(transform_path)
+
     def get_transform_path(self):
         """Return the path to the transform matrix."""
         return self.__transform_path
@@ -187,7 +281,14 @@ class Logic:
 
         :param str parcellation: name of the parcellation to use
         """
+        import siibra
+
         self.__parcellation = siibra.parcellations[parcellation]
+        # Load the maps in the background so that they are ready for the
+        # first assignment.
+        self.get_map_cache().prefetch(
+            self.__parcellation,
+            siibra.spaces.MNI_152_ICBM_2009C_NONLINEAR_ASYMMETRIC)
 
     def get_parcellation(self):
         """Return the current parcellation that is used for region assignment."""
@@ -224,6 +325,8 @@ class Logic:
 
     def get_receptors(self):
         """Return all receptors that are available in siibra."""
+        import siibra
+
         return siibra.vocabularies.RECEPTOR_SYMBOLS.keys()
 
     def check_in_path(self, in_path):
@@ -331,9 +434,9 @@ class Logic:
         self.__in_path_calc = self.__in_path
         self.__out_path_calc = self.__out_path
         self.__name_calc = self.__name
-        self.__reorient_path_calc = os.path.join(
-            self.__tmp_dir.name, f'{self.__name}_reorient.nii.gz')
-        nib.save(self.__nifti_image, self.__reorient_path_calc)
+        # Reuse the reoriented input of previous runs on the same file.
+        self.__reorient_path_calc = save_reoriented(
+            self.__nifti_image, self.__in_path, self.__name)
 
     def strip_skull(self):
         """Strip the skull of the input brain using HD-BET.
@@ -343,16 +446,33 @@ class Logic:
         input = os.path.normpath(self.__reorient_path_calc)
         output = os.path.normpath(os.path.join(
             self.__out_path_calc, f'{self.__name_calc}_stripped.nii.gz'))
+        mask = os.path.normpath(os.path.join(
+            self.__out_path_calc, f'{self.__name_calc}_stripped_mask.nii.gz'))
+        settings = {'mode': 'fast', 'device': 'cpu', 'postprocess': True,
+                    'do_tta': False}
+
+        # Skip skull stripping if the results of an identical run exist.
+        manifest = ResultManifest(self.__out_path_calc, self.__name_calc)
+        key = hash_key('skull stripping', hash_file(self.__in_path_calc),
+                       settings, tool_versions()['HD-BET'])
+        if manifest.is_current('skull stripping', key):
+            logging.getLogger(mriwarp_name).info(
+                f'Reusing skull stripping results in {self.__out_path_calc}')
+            return
+
+        from HD_BET.run import run_hd_bet
 
         try:
             run_hd_bet(
                 [input],
                 [output],
-                mode='fast', device='cpu', postprocess=True, do_tta=False,
-                keep_mask=True, overwrite=True)
+                keep_mask=True, overwrite=True, **settings)
         except Exception as e:
             raise SubprocessFailedError(str(e))
 
+        manifest.update('skull stripping', key, self.__in_path_calc,
+                        [output, mask])
+
     def warp(self):
         """Register the stripped input brain to MNI152 space using ANTs.
 
@@ -368,7 +488,20 @@ class Logic:
         volume = os.path.normpath(os.path.join(
             self.__out_path_calc, f'{self.__name_calc}_registered.nii.gz'))
 
+        def fill(text):
+            """Replace the placeholders with actual files."""
+            text = text.replace('FIXED', fixed)
+            text = text.replace('MOVING', moving)
+            text = text.replace('MASK', mask)
+            text = text.replace('TRANSFORM', transform)
+            text = text.replace('VOLUME', volume)
+            text = text.replace('OUTPATH', self.__out_path_calc)
+            return text.replace('NAME', self.__name_calc)
+
         commands = []
+        # prefixes of the transformations and paths of the warped volumes 
+        # written by antsRegistration
+        prefixes, volumes = [], []
         for command in self.__warping_parameters.keys():
             cmd = 'antsRegistration '
             for parameter in self.__warping_parameters[command].keys():
@@ -381,16 +514,17 @@ class Logic:
                     # general parameters
                     cmd += f'--{parameter} {self.__warping_parameters[command][parameter]} '
 
-            # replace placeholders with actual files
-            cmd = cmd.replace('FIXED', fixed)
-            cmd = cmd.replace('MOVING', moving)
-            cmd = cmd.replace('MASK', mask)
-            cmd = cmd.replace('TRANSFORM', transform)
-            cmd = cmd.replace('VOLUME', volume)
-            cmd = cmd.replace('OUTPATH', self.__out_path_calc)
-            cmd = cmd.replace('NAME', self.__name_calc)
+            commands.append(fill(cmd).rstrip())
 
-            commands.append(cmd.rstrip())
+            # --output is either a prefix or [prefix, warped volumes].
+            output = fill(str(
+                self.__warping_parameters[command].get('output', '')))
+            output = [os.path.normpath(path.strip())
+                      for path in output.strip('[] ').split(',')
+                      if path.strip()]
+            if output:
+                prefixes.append(os.path.basename(output[0]))
+                volumes.extend(os.path.basename(path) for path in output[1:])
 
         # subprocess.run needs different structure of commands depending on OS.
         if platform.system() == 'Linux':
@@ -400,6 +534,17 @@ class Logic:
             for i in range(len(commands)):
                 commands[i] = commands[i].split(' ')
 
+        # Skip registration if the results of an identical run exist.
+        manifest = ResultManifest(self.__out_path_calc, self.__name_calc)
+        key = hash_key('registration', hash_file(self.__in_path_calc),
+                       hash_file(mask), hash_file(fixed),
+                       self.__warping_parameters, tool_versions()['ANTs'])
+        if manifest.is_current('registration', key):
+            logging.getLogger(mriwarp_name).info(
+                f'Reusing registration results in {self.__out_path_calc}')
+            commands = []
+        start = time.time_ns()
+
         try:
             for command in commands:
                 logging.getLogger(mriwarp_name).info(f'Executing: {command}')
@@ -414,6 +559,17 @@ class Logic:
             raise SubprocessFailedError(e.output.decode(
                 'utf-8').split('ERROR: ')[-1].rstrip())
 
+        if commands:
+            # Record the files written by antsRegistration. Only the expected
+            # output names are matched, as other subjects may share the
+            # output folder.
+            outputs = [
+                entry.path for entry in os.scandir(self.__out_path_calc)
+                if entry.is_file() and (entry.name in volumes or any(
+                    entry.name.startswith(prefix) for prefix in prefixes))
+                and entry.stat().st_mtime_ns >= start]
+            manifest.update('registration', key, self.__in_path_calc, outputs)
+
         if self.__in_path == self.__in_path_calc and self.__out_path == self.__out_path_calc:
             self.__transform_path = transform+'InverseComposite.h5'
 
@@ -427,25 +583,91 @@ class Logic:
         :raise mriwarp.SubprocessFailedError: if execution of 
         antsApplyTransformsToPoints failed
         """
-        # Warp from RAS to LBS because ANTs uses LBS.
-        source_points_lbs = (np.array([point])
-                             * (-1, -1, 1)).tolist()
-        source_points = pd.DataFrame(source_points_lbs, columns=['x', 'y', 'z'])
-        source_points.to_csv(
-            f'{os.path.join(self.__tmp_dir.name, "source_pts.csv")}',
-            index=False)
+        return self.warp_phys2mni_batch(np.array([point]))[0].tolist()
+
+    def warp_phys2mni_batch(self, points):
+        """Warp multiple points from subject's physical to MNI152 space using 
+        the transform matrix.
+
+        HDF5 transforms are applied in-process. Other transforms are applied 
+        with a single call of antsApplyTransformsToPoints.
+
+        :param numpy.ndarray points: Nx3 array of points in subject's physical 
+        space (RAS)
+        :return: Nx3 array of warped points in MNI152 space (RAS)
+        :rtype: numpy.ndarray
+        :raise mriwarp.SubprocessFailedError: if execution of 
+        antsApplyTransformsToPoints failed
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        if len(points) == 0:
+            return np.empty((0, 3))
+
+        # Warp from RAS to LPS because ANTs uses LPS.
+        source_points_lps = points * (-1, -1, 1)
+
+        transform = self.__load_transform()
+        if transform:
+            target_points_lps = transform.transform_points(source_points_lps)
+        else:
+            target_points_lps = self.__apply_ants_transform(source_points_lps)
+
+        # Warp from LPS to RAS because nibabel and numpy use RAS.
+        return target_points_lps * (-1, -1, 1)
+
+    def __load_transform(self):
+        """Load the HDF5 transform matrix once for in-process point warping.
+
+        :return: loaded transform or None if the transform can only be 
+        applied by ANTs
+        :rtype: voluba_mriwarp.transforms.CompositeTransform
+        """
+        from voluba_mriwarp.transforms import CompositeTransform
+
+        if not self.__transform_path.endswith('.h5'):
+            return None
+
+        key = (self.__transform_path,
+               os.path.getmtime(self.__transform_path))
+        if self.__transform_key != key:
+            self.__transform_key = key
+            try:
+                self.__transform = CompositeTransform(self.__transform_path)
+            except Exception as e:
+                logging.getLogger(mriwarp_name).warning(
+                    f'Could not load {self.__transform_path}, falling back to '
+                    f'antsApplyTransformsToPoints: {str(e)}')
+                self.__transform = None
+        return self.__transform
+
+    def __apply_ants_transform(self, points):
+        """Apply the transform matrix with antsApplyTransformsToPoints.
+
+        :param numpy.ndarray points: Nx3 array of points in subject's physical 
+        space (LPS)
+        :return: Nx3 array of warped points in MNI152 space (LPS)
+        :rtype: numpy.ndarray
+        :raise mriwarp.SubprocessFailedError: if execution of 
+        antsApplyTransformsToPoints failed
+        """
+        import pandas as pd
+
+        source_path = os.path.join(self.__tmp_dir.name, 'source_pts.csv')
+        target_path = os.path.join(self.__tmp_dir.name, 'target_pts.csv')
+        np.savetxt(source_path, points, delimiter=',', header='x,y,z',
+                   comments='')
 
         if platform.system() == 'Linux':
             command = [
                 f'antsApplyTransformsToPoints --dimensionality 3 '
-                f'--input {os.path.join(self.__tmp_dir.name, "source_pts.csv")} '
-                f'--output {os.path.join(self.__tmp_dir.name, "target_pts.csv")} '
+                f'--input {source_path} '
+                f'--output {target_path} '
                 f'--transform {self.__transform_path}']
         else:
             command = [
                 'antsApplyTransformsToPoints', '--dimensionality', '3',
-                '--input', f'{os.path.join(self.__tmp_dir.name, "source_pts.csv")}',
-                '--output', f'{os.path.join(self.__tmp_dir.name, "target_pts.csv")}',
+                '--input', f'{source_path}',
+                '--output', f'{target_path}',
                 '--transform', f'{self.__transform_path}']
 
         # In ANTs points are transformed from moving to fixed using the inverse transformation.
@@ -459,12 +681,8 @@ class Logic:
                 e.output.decode('utf-8').split('ERROR: ')[0].rstrip())
             raise SubprocessFailedError(e.output.decode('utf-8').rstrip())
 
-        target_points = pd.read_csv(
-            f'{os.path.join(self.__tmp_dir.name, "target_pts.csv")}')
-        target_points_lbs = target_points.to_numpy()
-
-        # Warp from LBS to RAS because nibabel and numpy use RAS.
-        return (target_points_lbs * (-1, -1, 1)).tolist()[0]
+        # ANTs may add columns (e.g. t) to the output CSV.
+        return pd.read_csv(target_path)[['x', 'y', 'z']].to_numpy(dtype=float)
 
     def warp_vox2phys(self, point):
         """Warp point from subject's voxel to physical space using the affine.
@@ -494,12 +712,12 @@ class Logic:
         :param tuple point: point in subject's voxel space
         :param float uncertainty_mm: uncertainty of a point in input's physical
         space
-        :return: source point in RAS, target point in RAS, assignments and 
-        urls to siibra-explorer
-        :rtype: list, list, list, dict
+        :return: source point in RAS, target point in RAS and assignments
+        :rtype: list, list, list
         :raise PointNotFoundError: if the given point is outside the brain
         """
-        multilevel_human = siibra.atlases.MULTILEVEL_HUMAN_ATLAS
+        import siibra
+
         mni152 = siibra.spaces.MNI_152_ICBM_2009C_NONLINEAR_ASYMMETRIC
 
         sort_value = 'correlation' if uncertainty_mm else 'map value'
@@ -512,13 +730,16 @@ class Logic:
         else:
             target_point_ras = source_point_ras
 
-        pmap = siibra.get_map(self.__parcellation, mni152,
-                              maptype='statistical')
+        pmap, voxel_index = self.get_map_cache().get(
+            self.__parcellation, mni152, maptype='statistical')
         target = siibra.Point(
             target_point_ras, space=mni152, sigma_mm=uncertainty_mm)
 
         try:
-            assignments = pmap.assign(target)
+            if voxel_index:
+                assignments = voxel_index.assign(target)
+            else:
+                assignments = pmap.assign(target)
         except IndexError:
             raise PointNotFoundError('Point doesn\'t match MNI152 space.')
         results = assignments.sort_values(by=sort_value, ascending=False)
@@ -526,12 +747,46 @@ class Logic:
         results = results.drop(
             ['input structure', 'centroid', 'volume', 'fragment'], axis=1)
         results = results.dropna(axis=1)
-        urls = {}
-        for region in results['region']:
-            urls[region.name] = siibra_explorer_toolsuite.run(
-                multilevel_human, mni152, self.__parcellation, region)
 
-        return source_point_ras, target_point_ras, results, urls
+        return source_point_ras, target_point_ras, results
+
+    def get_url(self, region, parcellation=None):
+        """Return the siibra-explorer url of a region.
+
+        Urls are only built when they are requested and are remembered per
+        atlas, space, parcellation and region.
+
+        :param str region: name of the region
+        :param siibra.Parcellation parcellation: parcellation of the region,
+        defaults to the current parcellation
+        :return: url to the region in siibra-explorer
+        :rtype: str
+        """
+        import siibra
+        import siibra_explorer_toolsuite
+
+        multilevel_human = siibra.atlases.MULTILEVEL_HUMAN_ATLAS
+        mni152 = siibra.spaces.MNI_152_ICBM_2009C_NONLINEAR_ASYMMETRIC
+        parcellation = parcellation or self.__parcellation
+
+        key = (multilevel_human.id, mni152.id, parcellation.id, region)
+        if key not in self.__urls:
+            self.__urls[key] = siibra_explorer_toolsuite.run(
+                multilevel_human, mni152, parcellation,
+                parcellation.get_region(region))
+        return self.__urls[key]
+
+    def get_map_cache(self):
+        """Return the cache of statistical maps used for region assignment.
+
+        :return: cache of statistical maps
+        :rtype: voluba_mriwarp.assignment.MapCache
+        """
+        from voluba_mriwarp.assignment import MapCache
+
+        if self.__map_cache is None:
+            self.__map_cache = MapCache()
+        return self.__map_cache
 
     def save_point(self, point, label):
         """Save a selected point.
@@ -560,43 +815,124 @@ class Logic:
         self.__saved_points = []
         self.__labels = []
 
+    def __get_mni_points(self):
+        """Return the saved points in MNI152 space.
+
+        :return: saved points as siibra.Point objects in MNI152 space
+        :rtype: list
+        """
+        import siibra
+
+        if self.__image_type == 'unaligned':
+            return [
+                siibra.Point(
+                    tuple(point), space='mni152', sigma_mm=self.__uncertainty)
+                for point in self.warp_phys2mni_batch(self.__saved_points)]
+        return [
+            siibra.Point(point, space='mni152', sigma_mm=self.__uncertainty)
+            for point in self.__saved_points]
+
+    def __get_labels(self):
+        """Return the labels of the saved points.
+
+        :return: labels of the saved points
+        :rtype: list
+        """
+        # Labels are tkinter variables in the GUI and strings in scripts.
+        return [label.get() if hasattr(label, 'get') else str(label)
+                for label in self.__labels]
+
+    def export_table(self, output_file, filter=None):
+        """Export the assignments of all saved points to a table without 
+        plotting.
+
+        The table holds the label, the coordinates in subject and MNI152 space
+        and the assignment values of each point with one row for each assigned
+        region. Points without assigned regions get a single row. The format
+        is chosen by the file extension (.csv, .parquet or .json).
+
+        :param str output_file: file to export the table to
+        :param voluba_mriwarp.filters.AssignmentFilter filter: filter to apply
+        to the assignments, export all assignments if None
+        :raise ValueError: if the file format is not supported or no points
+        are saved
+        """
+        import pandas as pd
+
+        from voluba_mriwarp.assignment import assign_points
+
+        extension = os.path.splitext(output_file)[1].lower()
+        if extension not in ['.csv', '.parquet', '.json']:
+            raise ValueError(f'Unsupported table format {extension}.')
+        if not self.__saved_points:
+            raise ValueError('There are no saved points to export.')
+
+        pmap, voxel_index = self.get_map_cache().get(
+            self.__parcellation, 'mni152', 'statistical')
+        mni_points = self.__get_mni_points()
+        assignments = pd.concat(
+            assign_points(mni_points, pmap, voxel_index),
+            keys=range(len(mni_points)), names=['point', None])
+        if filter:
+            assignments = filter.apply(
+                assignments,
+                'correlation' if self.__uncertainty else 'map value')
+        # The centroid equals the MNI152 coordinates of the point.
+        assignments = assignments.drop(columns='centroid').droplevel(1)
+        assignments['region'] = assignments['region'].map(
+            lambda region: region.name)
+
+        subject_points = np.array(self.__saved_points, dtype=float)
+        mni_coordinates = np.array(
+            [point.coordinate for point in mni_points], dtype=float)
+        points = pd.DataFrame(
+            {'label': self.__get_labels(),
+             'subject x': subject_points[:, 0],
+             'subject y': subject_points[:, 1],
+             'subject z': subject_points[:, 2],
+             'mni x': mni_coordinates[:, 0],
+             'mni y': mni_coordinates[:, 1],
+             'mni z': mni_coordinates[:, 2]},
+            index=pd.RangeIndex(len(mni_points), name='point'))
+        table = points.join(assignments, how='left').reset_index()
+
+        if extension == '.csv':
+            table.to_csv(output_file, index=False)
+        elif extension == '.parquet':
+            table.to_parquet(output_file, index=False)
+        else:
+            table.to_json(output_file, orient='records', indent=4)
+        logging.getLogger(mriwarp_name).info(
+            f'Assignments of {len(points)} points written to {output_file}')
+
     def export_assignments(
             self, output_file, filter, features, receptors, cohorts,
-            progress_indicator):
+            progress_indicator, quality='screen'):
         """Export all assignments together with linked features to a PDF report.
 
         :param str output_file: PDF file to export report to
-        :param list filter: filter of the form [column, sign, value] to apply 
+        :param voluba_mriwarp.filters.AssignmentFilter filter: filter to apply
         to the assignments before export
         :param list features: linked features to export for each region
         :param list receptors: receptors to plot a ReceptorDensityProfile for
         :param list cohorts: cohorts to plot connectivity plots for
         :param tkinter.IntVar progress_indicator: variable indicating the export
         progress
+        :param str quality: name of the quality profile of the figures
         """
         from voluba_mriwarp.reports import AssignmentReport
 
         report = AssignmentReport(
             parcellation=self.__parcellation, filter=filter,
-            progress=progress_indicator)
+            progress=progress_indicator, map_cache=self.get_map_cache(),
+            quality=quality)
         filename = os.path.basename(self.__in_path)
-
-        # Transfer points to siibra.Point objects.
-        if self.__image_type == 'unaligned':
-            mni_points = [
-                siibra.Point(
-                    self.__warp_phys2mni(point),
-                    space='mni152', sigma_mm=self.__uncertainty)
-                for point in self.__saved_points]
-        else:
-            mni_points = [
-                siibra.Point(
-                    point, space='mni152', sigma_mm=self.__uncertainty)
-                for point in self.__saved_points]
-        labels = [label.get() for label in self.__labels]
+        mni_points = self.__get_mni_points()
+        labels = self.__get_labels()
 
         # Filter the region assignments.
-        assignments = report.assign(mni_points)
+        assignments = report.assign(
+            mni_points, 'correlation' if self.__uncertainty else 'map value')
 
         # Create the PDF report.
         report.create_report(assignments=assignments,
@@ -1,16 +1,186 @@
 import logging
+import multiprocessing
 import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, wait
 from datetime import datetime
-from tempfile import mkdtemp
+from tempfile import TemporaryDirectory
+from textwrap import wrap
 
 import matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import siibra
 from fpdf import FPDF
 from nilearn import plotting
+from PIL import Image
+
+from voluba_mriwarp.assignment import assign_points
+from voluba_mriwarp.cache import RenderCache, hash_key
+from voluba_mriwarp.config import (mriwarp_name, quality_profiles,
+                                   report_window, report_workers)
+from voluba_mriwarp.filters import AssignmentFilter
+
+# features plotted as connectivity profiles of the assigned region
+CONNECTIVITY_FEATURES = ['FunctionalConnectivity', 'StreamlineCounts',
+                         'StreamlineLengths']
+# line height of text in the PDF report
+TEXT_HEIGHT = 4
+
+
+def _init_plot_worker():
+    """Initialize a process rendering plots with the Agg backend."""
+    matplotlib.use('Agg')
+
+
+def _save_figure(fig, filename, quality, vector=False):
+    """Save a figure with the image encoding of a quality profile.
+
+    :param matplotlib.figure.Figure fig: figure to save
+    :param str filename: file to save to without the file extension
+    :param str quality: name of the quality profile
+    :param bool vector: True if the figure may be saved as vector graphic
+    :return: filename the figure is saved to
+    :rtype: str
+    """
+    profile = quality_profiles[quality]
+    if vector and profile['vector']:
+        filename = f'{filename}.svg'
+        fig.savefig(filename, format='svg')
+    elif profile['format'] == 'jpeg':
+        filename = f'{filename}.jpg'
+        fig.savefig(filename, dpi=profile['dpi'], pil_kwargs={
+            'quality': profile['jpeg_quality'], 'optimize': True})
+    else:
+        filename = f'{filename}.png'
+        fig.savefig(filename, dpi=profile['dpi'])
+        if profile['colors']:
+            # Reduce the figure to a color palette.
+            with Image.open(filename) as image:
+                image = image.convert('RGB').quantize(profile['colors'])
+            # The quantized image does not keep the resolution.
+            image.save(filename, optimize=True,
+                       dpi=(profile['dpi'], profile['dpi']))
+    return filename
+
+
+def _plot_pmap(parcellation, region, space, maptype, coordinate, filename,
+               quality):
+    """Plot the pmap of a region to a file.
+
+    This function runs in a worker process, so regions are passed by name.
+
+    :param str parcellation: id of the parcellation of the region
+    :param str region: name of the region assigned to the point
+    :param str space: id of the space of the map
+    :param siibra.MapType maptype: type of the map
+    :param tuple coordinate: point in the space of the map
+    :param str filename: file to plot to without the file extension
+    :param str quality: name of the quality profile of the plot
+    :return: filename the pmap is plotted to
+    :rtype: list
+    """
+    region = siibra.parcellations[parcellation].get_region(region)
+    fig, ax = plt.subplots(
+        1, 1, figsize=(6, 3), dpi=quality_profiles[quality]['dpi'])
+    pmap = region.fetch_regional_map(space, maptype)
+    plot = plotting.plot_glass_brain(
+        pmap, axes=ax, colorbar=False, alpha=0.3, cmap='viridis')
+    plot.add_markers([coordinate], marker_size=15)
+    filename = _save_figure(fig, filename, quality)
+    plt.close('all')
+    return [filename]
+
+
+def _plot_features(parcellation, region, feature, selected_receptors,
+                   plot_dir, quality):
+    """Plot the linked feature of a region to a file.
+
+    This function runs in a worker process, so regions are passed by name.
+
+    :param str parcellation: id of the parcellation of the region
+    :param str region: name of the region assigned to the point
+    :param str feature: feature linked to the assigned region
+    :param list selected_receptors: receptors to plot a 
+    ReceptorDensityProfile for
+    :param str plot_dir: folder to plot to
+    :param str quality: name of the quality profile of the plots
+    :return: filenames the feature data is plotted to
+    :rtype: list
+    """
+    region = siibra.parcellations[parcellation].get_region(region)
+    receptors = [
+        f'{receptor} '
+        f'({siibra.vocabularies.RECEPTOR_SYMBOLS[receptor]["receptor"]["name"]})'
+        for receptor in selected_receptors]
+
+    def save(filename):
+        plt.tight_layout(pad=0.2)
+        filename = _save_figure(plt.gcf(), filename, quality, vector=True)
+        plt.close('all')
+        return filename
 
-from voluba_mriwarp.config import mriwarp_name
+    # CellDensityProfile yields one aggregated feature.
+    if feature == 'CellDensityProfile':
+        filename = os.path.join(plot_dir, f'{region.key}_{feature}')
+        features = siibra.features.get(region, feature)
+        if features:
+            features[0].plot()
+            return [save(filename)]
+        else:
+            return []
+    # ReceptorDensityFingerprint may yield multiple features.
+    elif feature == 'ReceptorDensityFingerprint':
+        filenames = []
+        features = siibra.features.get(region, feature)
+        for i, feat in enumerate(features):
+            filename = os.path.join(
+                plot_dir, f'{region.key}_{feature}_{i+1}')
+            feat.polar_plot()
+            filenames.append(save(filename))
+        return filenames
+    # ReceptorDensityProfile yields one feature for each receptor.
+    elif feature == 'ReceptorDensityProfile':
+        filenames = []
+        features = siibra.features.get(region, feature)
+        for feat in features:
+            if feat.receptor in receptors:
+                filename = os.path.join(
+                    plot_dir, f'{region.key}_{feature}_{feat.receptor}')
+                feat.plot()
+                filenames.append(save(filename))
+        return filenames
+    return []
+
+
+def _plot_profile(profile, filename, quality):
+    """Plot a connectivity profile to a file.
+
+    The plot looks like siibra's Tabular.plot of
+    RegionalConnectivity.get_profile.
+
+    :param dict profile: connectivity profile as returned by 
+    AssignmentReport._get_profile
+    :param str filename: file to plot to without the file extension
+    :param str quality: name of the quality profile of the plot
+    :return: filename the profile is plotted to
+    :rtype: list
+    """
+    name = profile['name']
+    data = pd.DataFrame(
+        {name: profile['values']},
+        index=pd.Index(profile['targets'], name='Target regions'))
+    title = '\n'.join(
+        wrap(f'{profile["modality"]} in {profile["region"]}', 40))
+    ax = data.plot(kind='bar', y=name, yerr=None, width=0.95,
+                   ylabel=f'{name} ', title=title, grid=True, legend=False)
+    ax.set_title(ax.get_title(), fontsize='medium')
+    ax.set_xticklabels(ax.get_xticklabels(), rotation=60, ha='right')
+    plt.tight_layout(pad=0.2)
+    filename = _save_figure(plt.gcf(), filename, quality, vector=True)
+    plt.close('all')
+    return [filename]
 
 
 class AssignmentReport:
@@ -18,7 +188,8 @@ class AssignmentReport:
 
     def __init__(
             self, progress, parcellation='julich 3.0', space='mni152',
-            maptype='statistical', filter=['correlation', '>', 0.3]):
+            maptype='statistical', filter=None, map_cache=None,
+            quality='screen'):
         """Initialize the report.
 
         :param tkinter.IntVar progress: variable to update the current progress in 
@@ -26,79 +197,102 @@ class AssignmentReport:
         :param str parcellation: parcellation of the maps used for assignment
         :param str space: space of the maps used for assignment
         :param str maptype: type of the maps used for assignment
-        :param list filter: filter of the form [column, sign, value] to apply 
-        to the assignments
+        :param voluba_mriwarp.filters.AssignmentFilter filter: filter to apply
+        to the assignments, defaults to correlation > 0.3
+        :param voluba_mriwarp.assignment.MapCache map_cache: cache to take the
+        maps from instead of fetching them from siibra
+        :param str quality: name of the quality profile of the figures, one of
+        quality_profiles
+        :raise ValueError: if the quality profile does not exist
         """
-        self.filter = filter
-        self.dpi = 300
+        if quality not in quality_profiles:
+            raise ValueError(f'Unknown quality profile {quality}.')
+        self.filter = filter or AssignmentFilter([['correlation', '>', 0.3]])
+        self.quality = quality
+        # Cached figures are keyed by the settings of the quality profile.
+        self.__quality_key = tuple(sorted(quality_profiles[quality].items()))
         self.progress = progress
 
-        self.pmaps = siibra.get_map(
-            parcellation=parcellation, space=space, maptype=maptype)
+        if map_cache:
+            self.pmaps, self.voxel_index = map_cache.get(
+                parcellation, space, maptype)
+        else:
+            self.pmaps = siibra.get_map(
+                parcellation=parcellation, space=space, maptype=maptype)
+            self.voxel_index = None
 
-        tmp_dir = mkdtemp()
-        self.__plot_dir = os.path.join(tmp_dir, 'plots')
+        self.__plot_dir = None
+        self.__renders = {}
+        self.__matrices = {}
+
+    def __check_cancelled(self):
+        """Stop the calling thread if the export was cancelled."""
+        # "hack" to kill the calling thread
+        if self.progress.get() == -1:
+            exit(0)
 
     def __set_progress(self, num_points):
         """Increase the progress depending on the number of processed points.
 
         :param int num_points: number of points that are processed
         """
-        # "hack" to kill the calling thread
-        if self.progress.get() == -1:
-            exit(0)
+        self.__check_cancelled()
         # There are four steps iterating over the points:
         # assign, plot pmaps, plot features, create report
         self.progress.set(self.progress.get() + 100/(num_points*4))
 
-    def assign(self, points, sort_by='correlation'):
+    def assign(self, points, sort_by=None):
         """Run an anatomical assignment for the given points.
 
         :param list points: list of points to assign to regions
-        :param str sort_by: column to sort the assignment by
+        :param str sort_by: column to sort the assignment by, chosen by
+        the filter if None
         :return list: list of filtered assignments for each point
         """
-        assignments = []
-        for point in points:
-            self.__set_progress(len(points))
-            initial_assignment = self.pmaps.assign(point)
-            initial_assignment.sort_values(
-                by=sort_by, ascending=False, inplace=True)
-            # Apply a user-defined filter to the assignments.
-            assignment = self._filter_assignments(initial_assignment)
-            assignments.append(assignment)
-
-        return assignments
-
-    def _filter_assignments(self, initial_assignments):
-        """Filter the assignments by a user-defined filter.
-
-        :param pandas.DataFrame initial_assignments: unfiltered assignments 
-        :return: filtered assignments
-        :rtype: pandas.DataFrame
+        initial_assignments = assign_points(
+            points, self.pmaps, self.voxel_index,
+            lambda count: self.__set_progress(len(points) / count))
+        return self._filter_assignments(initial_assignments, sort_by)
+
+    def _filter_assignments(self, initial_assignments, sort_by=None):
+        """Filter the assignments of all points by the user-defined filter.
+
+        The assignments are concatenated into one DataFrame so that the filter
+        is evaluated once for all points.
+
+        :param list initial_assignments: unfiltered assignments for each point
+        :param str sort_by: column to sort the assignments by, chosen by
+        the filter if None
+        :return: filtered assignments for each point
+        :rtype: list
         """
-        mapping = {
-            '<': lambda column, value: column < value,
-            '<=': lambda column, value: column < value,
-            '>': lambda column, value: column > value,
-            '>=': lambda column, value: column > value,
-            '=': lambda column, value: column == value
-        }
-        column, sign, value = self.filter
-        initial_assignments = initial_assignments.drop(
-            ['centroid', 'volume', 'fragment'], axis=1)
-        results = []
-        for _, row in initial_assignments.iterrows():
-            if row[column] and mapping[sign](row[column], value):
-                results.append(row)
-
-        return pd.DataFrame(results)
+        if not initial_assignments:
+            return []
+        assignments = pd.concat(
+            initial_assignments, keys=range(len(initial_assignments)),
+            names=['point', None]).drop(
+                ['centroid', 'volume', 'fragment'], axis=1)
+        assignments = self.filter.apply(assignments, sort_by)
+
+        # Split the filtered assignments into one DataFrame per point.
+        bounds = np.searchsorted(
+            assignments.index.get_level_values('point'),
+            np.arange(len(initial_assignments) + 1))
+        assignments = assignments.droplevel('point')
+        return [assignments.iloc[start:stop]
+                for start, stop in zip(bounds[:-1], bounds[1:])]
 
     def create_report(
             self, assignments, subject_points, mni_points, labels, image,
             image_filename, features, receptors, cohorts, output_file):
         """Create a PDF report of assigned regions and linked features.
 
+        The report is built point by point. While a point is added to the PDF,
+        the plots of the next points are rendered in worker processes, so only
+        the plots of a few points are pending at any time. Finished plots are
+        moved to the render cache and the scratch folder is removed when the
+        export ends.
+
         :param list assignments: region assignments for multiple points
         :param list subject_points: points in subject's physical space
         :param list mni_points: points in MNI152 space
@@ -118,49 +312,172 @@ class AssignmentReport:
 
         # Plot intermediate plots to a temporary directory.
         self.__set_progress(0.25)
-        if not os.path.isdir(self.__plot_dir):
-            os.makedirs(self.__plot_dir)
+        scratch = TemporaryDirectory(prefix=f'{mriwarp_name}-')
+        self.__plot_dir = scratch.name
 
         # Activate matplotlib png renderer.
         self.__set_progress(0.25)
         backend = matplotlib.get_backend()
         matplotlib.use('Agg')
 
-        # Plot the input image.
-        self.__set_progress(0.25)
-        input_plot = self._plot_input(image)
-
-        # Plot the probability maps.
-        pmap_plots = {}
-        for i, assignment in enumerate(assignments):
-            self.__set_progress(len(assignments))
-            if assignment.empty:
-                continue
-            label = labels[i]
-            point = mni_points[i]
-            for region in assignment.region:
-                pmap_plots[f'{region}_{label}'] = self._plot_pmap(
-                    region, point, label)
-
-        # Plot linked features.
-        feature_plots = {}
-        for i, assignment in enumerate(assignments):
-            self.__set_progress(len(assignments))
-            if assignment.empty:
+        # Render the plots in worker processes. Spawned workers do not
+        # inherit the state of the GUI process.
+        executor = ProcessPoolExecutor(
+            max_workers=report_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_plot_worker)
+
+        # Figures are looked up in the render cache and only rendered if
+        # they are not cached. Connectivity matrices are loaded once for all
+        # regions of this export.
+        render_cache = RenderCache()
+        self.__renders = {}
+        self.__matrices = {}
+        try:
+            scheduled = deque()
+            num_scheduled = 0
+
+            def schedule(last):
+                nonlocal num_scheduled
+                while num_scheduled < min(last, len(assignments)):
+                    scheduled.append(self.__schedule_point(
+                        executor, render_cache, assignments[num_scheduled],
+                        mni_points[num_scheduled], features, receptors,
+                        cohorts))
+                    num_scheduled += 1
+
+            # Plot the input image while the workers render the first points.
+            schedule(report_window)
+            self.__set_progress(0.25)
+            pdf = self._start_pdf(self._plot_input(image), image_filename)
+
+            for idx, assignment in enumerate(assignments):
+                schedule(idx + report_window)
+                pmap_plots, feature_plots = self.__collect_point(
+                    render_cache, *scheduled.popleft())
+                self._add_point(
+                    pdf, assignment, pmap_plots, feature_plots, labels[idx],
+                    subject_points[idx], mni_points[idx])
+                # Plotting pmaps, plotting features and creating the report
+                # are done for each point at once.
+                self.__set_progress(len(assignments) / 3)
+
+            logging.getLogger(mriwarp_name).info(
+                f'Report written to {output_file}')
+            pdf.output(output_file)
+        finally:
+            # Running plots cannot be interrupted, so wait for them before
+            # removing the scratch folder. Pending plots are dropped if the
+            # export fails or is cancelled.
+            executor.shutdown(wait=True, cancel_futures=True)
+            scratch.cleanup()
+            self.__renders = {}
+            self.__matrices = {}
+            matplotlib.use(backend)
+
+        # Evict only after the PDF is built as it uses the cached figures.
+        render_cache.evict()
+
+    def __schedule_point(self, executor, render_cache, assignment, point,
+                         features, receptors, cohorts):
+        """Schedule the plots of a point that are neither cached nor 
+        scheduled yet.
+
+        :param concurrent.futures.Executor executor: pool rendering the plots
+        :param voluba_mriwarp.cache.RenderCache render_cache: cache of 
+        rendered figures
+        :param pandas.DataFrame assignment: region assignments of the point
+        :param siibra.Point point: point in MNI152 space
+        :param list features: linked features to export for each region
+        :param list receptors: receptors to plot a ReceptorDensityProfile for
+        :param list cohorts: cohorts to plot connectivity plots for
+        :return: render keys of the pmap plots by region and render keys of
+        the feature plots by region and feature
+        :rtype: tuple
+        """
+        parcellation = self.pmaps.parcellation.id
+        coordinate = tuple(round(float(value), 2)
+                           for value in point.coordinate)
+        pmap_keys = {}
+        feature_keys = {}
+        if assignment.empty:
+            return pmap_keys, feature_keys
+
+        for region in assignment.region:
+            key = pmap_keys[region] = (
+                'pmap', parcellation, region.name, self.pmaps.space.id,
+                str(self.pmaps.maptype), coordinate, self.__quality_key,
+                siibra.__version__)
+            if self.__is_available(render_cache, key):
                 continue
-            for region in assignment.region.unique():
-                if region in feature_plots.keys():
-                    continue
-                feature_plots[region] = {}
-                for feature in features:
-                    feature_plots[region][feature] = self.__plot_features(
-                        region, feature, receptors, cohorts)
-
-        # Build the PDF report.
-        self._build_pdf(
-            assignments, input_plot, pmap_plots, feature_plots, labels,
-            subject_points, mni_points, image_filename, output_file)
-        matplotlib.use(backend)
+            filename = os.path.join(self.__plot_dir, hash_key(*key))
+            self.__renders[key] = executor.submit(
+                _plot_pmap, parcellation, region.name, self.pmaps.space.id,
+                self.pmaps.maptype, coordinate, filename, self.quality)
+
+        # Features are split into one job for each receptor or cohort.
+        for region in assignment.region.unique():
+            for feature in features:
+                keys = feature_keys[region, feature] = []
+                for variant, job_receptors in self.__split_feature(
+                        feature, receptors, cohorts):
+                    key = ('feature', parcellation, region.name, feature,
+                           variant, self.__quality_key, siibra.__version__)
+                    keys.append(key)
+                    if self.__is_available(render_cache, key):
+                        continue
+                    job = self.__submit_feature(
+                        executor, region, feature, variant, job_receptors)
+                    if job is None:
+                        self.__renders[key] = render_cache.put([], *key)
+                    else:
+                        self.__renders[key] = job
+        return pmap_keys, feature_keys
+
+    def __is_available(self, render_cache, key):
+        """Check if a plot is already scheduled or cached.
+
+        :param voluba_mriwarp.cache.RenderCache render_cache: cache of 
+        rendered figures
+        :param tuple key: render key of the plot
+        :return: True if the plot does not need to be scheduled, False
+        otherwise.
+        :rtype: bool
+        """
+        if key not in self.__renders:
+            cached = render_cache.get(*key)
+            if cached is not None:
+                self.__renders[key] = cached
+        return key in self.__renders
+
+    def __collect_point(self, render_cache, pmap_keys, feature_keys):
+        """Wait for the plots of a point and move them to the render cache.
+
+        :param voluba_mriwarp.cache.RenderCache render_cache: cache of 
+        rendered figures
+        :param dict pmap_keys: render keys of the pmap plots by region
+        :param dict feature_keys: render keys of the feature plots by region 
+        and feature
+        :return: filenames of the pmap plots by region and filenames of the
+        feature plots by region and feature
+        :rtype: tuple
+        """
+        keys = list(pmap_keys.values()) + [
+            key for parts in feature_keys.values() for key in parts]
+        self.__wait([self.__renders[key] for key in keys
+                     if isinstance(self.__renders[key], Future)])
+        for key in keys:
+            if isinstance(self.__renders[key], Future):
+                self.__renders[key] = render_cache.put(
+                    self.__renders[key].result(), *key)
+
+        pmap_plots = {region: self.__renders[key][0]
+                      for region, key in pmap_keys.items()}
+        feature_plots = {region: {} for region in pmap_plots}
+        for (region, feature), parts in feature_keys.items():
+            feature_plots[region][feature] = [
+                filename for key in parts for filename in self.__renders[key]]
+        return pmap_plots, feature_plots
 
     def _plot_input(self, image):
         """Plot the input image to a file.
@@ -169,134 +486,150 @@ class AssignmentReport:
         :return: filename the input image is plotted to
         :rtype: string
         """
-        filename = os.path.join(self.__plot_dir, 'input.png')
-        plt.ion()
-        fig, ax = plt.subplots(1, 1, figsize=(6, 3), dpi=self.dpi)
+        fig, ax = plt.subplots(
+            1, 1, figsize=(6, 3), dpi=quality_profiles[self.quality]['dpi'])
         plotting.plot_img(image, axes=ax, cmap='gray',
                           draw_cross=False, annotate=False)
-        plt.ioff()
-        fig.savefig(filename, dpi=self.dpi)
+        filename = _save_figure(
+            fig, os.path.join(self.__plot_dir, 'input'), self.quality)
+        plt.close(fig)
         return filename
 
-    def _plot_pmap(self, region, point, label):
-        """Plot the pmap of a region to a file.
+    def __submit_feature(self, executor, region, feature, variant, receptors):
+        """Schedule the plot of a linked feature of a region.
 
-        :param siibra.Region region: region assigned to the given point
-        :param siibra.Point point: point
-        :param str label: label of the point
-        :return: filename the pmap is plotted to
-        :rtype: string
+        :param concurrent.futures.Executor executor: pool rendering the plots
+        :param siibra.Region region: region assigned to a point
+        :param str feature: feature linked to the assigned region
+        :param str variant: cohort of a connectivity feature
+        :param list receptors: receptors to plot a ReceptorDensityProfile for
+        :return: future of the plot job or None if there is nothing to plot
+        :rtype: concurrent.futures.Future
         """
-        filename = os.path.join(
-            self.__plot_dir, f'{region.key}_{label}_pmap.png')
-        fig, ax = plt.subplots(1, 1, figsize=(6, 3), dpi=self.dpi)
-        plt.ion()
-        pmap = region.fetch_regional_map(self.pmaps.space, self.pmaps.maptype)
-        plot = plotting.plot_glass_brain(
-            pmap, axes=ax, colorbar=False, alpha=0.3, cmap='viridis')
-        plot.add_markers([point.coordinate], marker_size=15)
-        plt.ioff()
-        fig.savefig(filename, dpi=self.dpi)
-        return filename
-
-    def __plot_features(self, region, feature, selected_receptors, cohorts):
-        """Plot the linked feature of a region to a file.
-
-        :param siibra.Region region: region assigned to the given point
-        :param siibra.Feature feature: feature linked to the assigned region
-        :param list selected_receptors: receptors to plot a 
-        ReceptorDensityProfile for
+        if feature in CONNECTIVITY_FEATURES:
+            profile = self._get_profile(
+                self.__matrices, feature, variant, region)
+            if profile is None:
+                return None
+            filename = os.path.join(
+                self.__plot_dir, f'{region.key}_{feature}_{variant}')
+            return executor.submit(
+                _plot_profile, profile, filename, self.quality)
+        return executor.submit(
+            _plot_features, self.pmaps.parcellation.id, region.name, feature,
+            receptors, self.__plot_dir, self.quality)
+
+    def __split_feature(self, feature, receptors, cohorts):
+        """Split the plots of a feature into one job for each receptor or
+        cohort.
+
+        :param str feature: feature linked to the assigned regions
+        :param list receptors: receptors to plot a ReceptorDensityProfile for
         :param list cohorts: cohorts to plot connectivity plots for
-        :return: filenames the feature data is plotted to
+        :return: list of (receptor or cohort, receptors to plot) tuples for
+        each job
         :rtype: list
         """
-        receptors = [
-            f'{receptor} '
-            f'({siibra.vocabularies.RECEPTOR_SYMBOLS[receptor]["receptor"]["name"]})'
-            for receptor in selected_receptors]
+        if feature == 'ReceptorDensityProfile':
+            return [(receptor, [receptor]) for receptor in receptors]
+        if feature in CONNECTIVITY_FEATURES:
+            return [(cohort, receptors) for cohort in cohorts]
+        return [(None, receptors)]
+
+    def _load_matrix(self, feature, cohort):
+        """Load the connectivity matrix of a cohort averaged across 
+        subjects.
+
+        Like in the former per-region plots, the first matrix of the cohort
+        is used.
+
+        :param str feature: connectivity feature
+        :param str cohort: cohort of the matrix
+        :return: matrix with its region names and metadata or None if the
+        cohort has no matrix
+        :rtype: dict
+        """
+        for feat in siibra.features.get(self.pmaps.parcellation, feature):
+            if feat.cohort != cohort:
+                continue
+            logging.getLogger(mriwarp_name).info(
+                f'Loading {feature} matrix of {cohort}')
+            matrix = feat.get_matrix()
+            regions = [region if isinstance(region, tuple) else (region,)
+                       for region in matrix.index]
+            return {
+                'values': matrix.to_numpy(),
+                'regions': regions,
+                'index': {region.name: i for i, entry in enumerate(regions)
+                          for region in entry},
+                'targets': [str(region) for region in matrix.index],
+                'name': feat.name,
+                'modality': f'{feat.modality} {feat.cohort}'}
+        return None
+
+    def _get_profile(self, matrices, feature, cohort, region, max_rows=30):
+        """Slice the connectivity profile of a region from a matrix.
+
+        The result equals RegionalConnectivity.get_profile: the column of
+        the region is cut to max_rows entries, filtered for positive values
+        and sorted by descending connectivity.
+
+        :param dict matrices: matrices already loaded for this export
+        :param str feature: connectivity feature
+        :param str cohort: cohort of the matrix
+        :param siibra.Region region: region to get the profile for
+        :param int max_rows: maximum number of target regions
+        :return: profile or None if the region is not in the matrix
+        :rtype: dict
+        """
+        if (feature, cohort) not in matrices:
+            matrices[feature, cohort] = self._load_matrix(feature, cohort)
+        matrix = matrices[feature, cohort]
+        if matrix is None:
+            return None
+
+        column = matrix['index'].get(region.name)
+        if column is None:
+            # Fall back to siibra's fuzzy region matching.
+            matches = [i for i, entry in enumerate(matrix['regions'])
+                       if any(r.matches(region) for r in entry)]
+            if len(matches) != 1:
+                logging.getLogger(mriwarp_name).warning(
+                    f'{region} is not part of the {feature} matrix of '
+                    f'{cohort}.')
+                return None
+            column = matches[0]
+
+        values = matrix['values'][:, column]
+        last_index = min(max_rows, len(values) - 1)
+        values = values[:last_index]
+        targets = np.array(matrix['targets'][:last_index], dtype=object)
+        keep = values > 0
+        order = np.argsort(-values[keep], kind='stable')
+        return {'name': matrix['name'], 'modality': matrix['modality'],
+                'region': matrix['targets'][column],
+                'values': values[keep][order],
+                'targets': list(targets[keep][order])}
+
+    def __wait(self, futures):
+        """Wait for plot jobs while checking the export for cancellation.
+
+        :param list futures: futures of the plot jobs
+        """
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=0.5)
+            self.__check_cancelled()
 
-        # CellDensityProfile yields one aggregated feature.
-        if feature == 'CellDensityProfile':
-            filename = os.path.join(
-                self.__plot_dir, f'{region.key}_{feature}.png')
-            features = siibra.features.get(region, feature)
-            if features:
-                plt.ion()
-                features[0].plot()
-                plt.tight_layout(pad=0.2)
-                plt.ioff()
-                plt.savefig(filename, dpi=self.dpi)
-                return [filename]
-            else:
-                return []
-        # ReceptorDensityFingerprint may yield multiple features.
-        elif feature == 'ReceptorDensityFingerprint':
-            filenames = []
-            features = siibra.features.get(region, feature)
-            for i, feat in enumerate(features):
-                filename = os.path.join(
-                    self.__plot_dir, f'{region.key}_{feature}_{i+1}.png')
-                plt.ion()
-                feat.polar_plot()
-                plt.tight_layout(pad=0.2)
-                plt.ioff()
-                plt.savefig(filename, dpi=self.dpi)
-                filenames.append(filename)
-            return filenames
-        # ReceptorDensityProfile yields one feature for each receptor.
-        elif feature == 'ReceptorDensityProfile':
-            filenames = []
-            features = siibra.features.get(region, feature)
-            for feat in features:
-                if feat.receptor in receptors:
-                    filename = os.path.join(
-                        self.__plot_dir,
-                        f'{region.key}_{feature}_{feat.receptor}.png')
-                    plt.ion()
-                    feat.plot()
-                    plt.tight_layout(pad=0.2)
-                    plt.ioff()
-                    plt.savefig(filename, dpi=self.dpi)
-                    filenames.append(filename)
-            return filenames
-        # Connectivity features yield one feature for each cohort.
-        else:
-            filenames = []
-            features = siibra.features.get(region.parcellation, feature)
-            for feat in features:
-                if feat.cohort in cohorts:
-                    filename = os.path.join(
-                        self.__plot_dir,
-                        f'{region.key}_{feature}_{feat.cohort}.png')
-                    if not filename in filenames:
-                        plt.ion()
-                        feat.get_profile(region, max_rows=30).plot()
-                        plt.tight_layout(pad=0.2)
-                        plt.ioff()
-                        plt.savefig(filename, dpi=self.dpi)
-                        filenames.append(filename)
-            return filenames
-
-    def _build_pdf(
-            self, assignments, input_plot, pmap_plots, feature_plots, labels,
-            subject_points, mni_points, image_filename, output_file):
-        """Actually create a PDF report of assigned regions and linked features.
+    def _start_pdf(self, input_plot, image_filename):
+        """Create a PDF report with a title page.
 
-        :param list assignments: region assignments for multiple points
         :param str input_plot: filename of the input image plot
-        :param dict pmap_plots: filenames of the pmap plots
-        :param dict feature_plots: filenames of the feature plots
-        :param list labels: labels for each point
-        :param list subject_points: points in subject's physical space
-        :param list mni_points: points in MNI152 space
         :param str image_filename: filename of the input image
-        :param str output_file: PDF file to export report to
+        :return: PDF report to add the points to
+        :rtype: fpdf.FPDF
         """
-        logging.getLogger(mriwarp_name).info(
-            f'Building PDF report {output_file} for {len(assignments)} points.')
-
         pdf = FPDF()
-        text_height = 4
 
         # title page
         pdf.add_page()
@@ -310,92 +643,98 @@ class AssignmentReport:
         pdf.set_font('Helvetica', '', 10)
         pdf.set_xy(left, top + 14)
         pdf.multi_cell(
-            0, text_height, '\n'.join(
+            0, TEXT_HEIGHT, '\n'.join(
                 [f'Input scan: {image_filename}',
                  f'Parcellation: {self.pmaps.parcellation.name}', ' ',
-                 f'For each point, regions with {self.filter[0]} '
-                 f'{self.filter[1]} {self.filter[2]} are assigned.',
+                 f'For each point, regions with {self.filter} are assigned.',
                  ' ', f'siibra version {siibra.__version__}',
                  f'Computed on {datetime.now().strftime("%c")}']),)
 
         pdf.set_xy(left, top + 60)
         pdf.image(input_plot, w=180)
+        return pdf
+
+    def _add_point(
+            self, pdf, assignment, pmap_plots, feature_plots, label,
+            subject_point, mni_point):
+        """Add a page with the assigned regions and linked features of a 
+        point to the PDF report.
+
+        :param fpdf.FPDF pdf: PDF report
+        :param pandas.DataFrame assignment: region assignments of the point
+        :param dict pmap_plots: filenames of the pmap plots by region
+        :param dict feature_plots: filenames of the feature plots by region
+        and feature
+        :param str label: label of the point
+        :param subject_point: point in subject's physical space
+        :param siibra.Point mni_point: point in MNI152 space
+        """
+        # heading
+        pdf.add_page()
+        left = pdf.get_x()
+        pdf.set_font('Helvetica', 'BU', 12)
+        pdf.cell(40, TEXT_HEIGHT, f'Assignments for {label}')
 
-        # new page for each point
-        pdf.set_xy(left, top + 60 + 75)
-        for idx, assignment in enumerate(assignments):
-            # heading
-            self.__set_progress(len(assignments))
-            pdf.add_page()
-            pdf.set_font('Helvetica', 'BU', 12)
-            pdf.cell(40, text_height, f'Assignments for {labels[idx]}')
-
-            # point in subject and mni space
-            pdf.set_font('Helvetica', '', 10)
-            pdf.set_xy(left, 14 + text_height)
+        # point in subject and mni space
+        pdf.set_font('Helvetica', '', 10)
+        pdf.set_xy(left, 14 + TEXT_HEIGHT)
+        pdf.multi_cell(
+            0, TEXT_HEIGHT,
+            f'Point in subject space: \t{subject_point} [mm]'
+            f'\nPoint in {siibra.spaces["mni152"].name}: '
+            f'{mni_point.coordinate} [mm]')
+
+        # no regions assigned
+        if assignment.empty:
+            pdf.set_xy(left, 2 * (14 + TEXT_HEIGHT))
             pdf.multi_cell(
-                0, text_height,
-                f'Point in subject space: \t{subject_points[idx]} [mm]'
-                f'\nPoint in {siibra.spaces["mni152"].name}: '
-                f'{mni_points[idx].coordinate} [mm]')
-
-            # no regions assigned
-            if assignment.empty:
-                pdf.set_xy(left, 2 * (14 + text_height))
-                pdf.multi_cell(
-                    0, text_height,
-                    f'No regions assigned with {self.filter[0]} '
-                    f'{self.filter[1]} {self.filter[2]}.')
-                continue
+                0, TEXT_HEIGHT, f'No regions assigned with {self.filter}.')
+            return
+
+        for _, row in assignment.iterrows():
+            # assignment
+            pdf.set_font('Helvetica', 'B', 10)
+            pdf.set_xy(left, pdf.get_y() + TEXT_HEIGHT + 10)
+            pdf.cell(
+                40, TEXT_HEIGHT, f'Point {label} assigned to {row.region}')
+
+            # assignment values
+            pdf.set_font('Helvetica', '', 5)
+            pdf.set_xy(left, pdf.get_y() + 5)
+            with pdf.table() as table:
+                header = table.row()
+                values = table.row()
+                for col in assignment.columns[2:]:
+                    header.cell(col)
+                    if row[col]:
+                        values.cell(f'{row[col]:.6f}')
+                    else:
+                        values.cell('')
+
+            # pmap plot
+            pdf.set_xy(left, pdf.get_y() + 5)
+            pdf.image(pmap_plots[row.region], h=40)
 
-            for _, row in assignment.iterrows():
-                # assignment
+            for feature in feature_plots[row.region].keys():
+                # heading with feature type
                 pdf.set_font('Helvetica', 'B', 10)
-                pdf.set_xy(left, pdf.get_y() + text_height + 10)
-                pdf.cell(
-                    40, text_height,
-                    f'Point {labels[idx]} assigned to {row.region}')
-
-                # assignment values
-                pdf.set_font('Helvetica', '', 5)
-                pdf.set_xy(left, pdf.get_y() + 5)
-                with pdf.table() as table:
-                    header = table.row()
-                    values = table.row()
-                    for col in assignment.columns[2:]:
-                        header.cell(col)
-                        if row[col]:
-                            values.cell(f'{row[col]:.6f}')
-                        else:
-                            values.cell('')
-
-                # pmap plot
-                pdf.set_xy(left, pdf.get_y() + 5)
-                pdf.image(pmap_plots[f'{row.region}_{labels[idx]}'], h=40)
-
-                for feature in feature_plots[row.region].keys():
-                    # heading with feature type
-                    pdf.set_font('Helvetica', 'B', 10)
+                pdf.set_xy(left, pdf.get_y() + 10)
+                pdf.cell(40, TEXT_HEIGHT, feature)
+
+                # feature plot
+                pdf.set_x(left)
+                y = pdf.get_y()
+                if feature_plots[row.region][feature]:
+                    for k, filename in enumerate(
+                            feature_plots[row.region][feature]):
+                        pdf.set_xy(pdf.get_x() + k %
+                                   2 * pdf.epw * 0.5, y + 10)
+                        pdf.image(filename, w=pdf.epw * 0.4)
+                # feature not available for region
+                else:
+                    pdf.set_font('Helvetica', '', 10)
                     pdf.set_xy(left, pdf.get_y() + 10)
-                    pdf.cell(40, text_height, feature)
-
-                    # feature plot
-                    pdf.set_x(left)
-                    y = pdf.get_y()
-                    if feature_plots[row.region][feature]:
-                        for k, filename in enumerate(
-                                feature_plots[row.region][feature]):
-                            pdf.set_xy(pdf.get_x() + k %
-                                       2 * pdf.epw * 0.5, y + 10)
-                            pdf.image(filename, w=pdf.epw * 0.4)
-                    # feature not available for region
-                    else:
-                        pdf.set_font('Helvetica', '', 10)
-                        pdf.set_xy(left, pdf.get_y() + 10)
-                        pdf.multi_cell(
-                            0, text_height,
-                            f'There is no {feature} information available '
-                            f'for {row.region}.')
-
-        logging.getLogger(mriwarp_name).info(f'Report written to {output_file}')
-        pdf.output(output_file)
+                    pdf.multi_cell(
+                        0, TEXT_HEIGHT,
+                        f'There is no {feature} information available '
+                        f'for {row.region}.')
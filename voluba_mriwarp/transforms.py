@@ -0,0 +1,149 @@
+import h5py
+import numpy as np
+
+
+class AffineTransform:
+    """ITK affine transform (MatrixOffsetTransformBase)"""
+
+    def __init__(self, parameters, fixed_parameters):
+        """Initialize the transform.
+
+        :param numpy.ndarray parameters: row-major 3x3 matrix followed by the
+        translation
+        :param numpy.ndarray fixed_parameters: center of rotation
+        """
+        self.matrix = np.asarray(parameters[:9], dtype=float).reshape(3, 3)
+        translation = np.asarray(parameters[9:12], dtype=float)
+        center = np.asarray(fixed_parameters[:3], dtype=float)
+        self.offset = translation + center - self.matrix @ center
+
+    def transform_points(self, points):
+        """Transform points in physical space (LPS).
+
+        :param numpy.ndarray points: Nx3 array of points
+        :return: Nx3 array of transformed points
+        :rtype: numpy.ndarray
+        """
+        return points @ self.matrix.T + self.offset
+
+
+class DisplacementFieldTransform:
+    """ITK displacement field transform with linear interpolation"""
+
+    def __init__(self, field, fixed_parameters):
+        """Initialize the transform.
+
+        :param numpy.ndarray field: displacements in ITK buffer order (x
+        fastest, three components per voxel)
+        :param numpy.ndarray fixed_parameters: size, origin, spacing and
+        row-major direction of the field
+        """
+        fixed_parameters = np.asarray(fixed_parameters, dtype=float)
+        self.size = fixed_parameters[:3].astype(int)
+        origin = fixed_parameters[3:6]
+        spacing = fixed_parameters[6:9]
+        direction = fixed_parameters[9:18].reshape(3, 3)
+        # Index order (z, y, x) as the buffer is stored with x fastest.
+        self.field = field.reshape(*self.size[::-1], 3)
+        self.origin = origin
+        self.phys2index = np.linalg.inv(direction @ np.diag(spacing))
+
+    def transform_points(self, points):
+        """Transform points in physical space (LPS).
+
+        Points outside the field are not displaced, like in ITK.
+
+        :param numpy.ndarray points: Nx3 array of points
+        :return: Nx3 array of transformed points
+        :rtype: numpy.ndarray
+        """
+        index = (points - self.origin) @ self.phys2index.T
+        inside = np.all((index >= -0.5) & (index < self.size - 0.5), axis=1)
+        if not inside.any():
+            return points.copy()
+
+        index = index[inside]
+        base = np.floor(index).astype(int)
+        distance = index - base
+        displacement = np.zeros((len(index), 3))
+        # Trilinear interpolation over the eight neighbours, clamped to the
+        # field border.
+        for corner in range(8):
+            offset = np.array([(corner >> axis) & 1 for axis in range(3)])
+            neighbour = np.clip(base + offset, 0, self.size - 1)
+            weight = np.prod(
+                np.where(offset, distance, 1 - distance), axis=1)
+            values = self.field[
+                neighbour[:, 2], neighbour[:, 1], neighbour[:, 0]]
+            displacement += weight[:, None] * values
+
+        transformed = points.copy()
+        transformed[inside] += displacement
+        return transformed
+
+
+class CompositeTransform:
+    """ITK composite transform read from a HDF5 file as written by ANTs"""
+
+    def __init__(self, path, mmap=False):
+        """Read all transforms of the composite transform.
+
+        :param str path: path to the HDF5 transform file
+        :param bool mmap: memory-map uncompressed displacement fields instead
+        of reading them into memory
+        :raise NotImplementedError: if the file contains an unsupported
+        transform type
+        """
+        self.transforms = []
+        with h5py.File(path, 'r') as file:
+            group = file['TransformGroup']
+            for key in sorted(group.keys(), key=int):
+                transform_type = group[key]['TransformType'][0]
+                if isinstance(transform_type, bytes):
+                    transform_type = transform_type.decode('utf-8')
+                name = transform_type.split('_')[0]
+                if name == 'CompositeTransform':
+                    continue
+
+                fixed_parameters = group[key]['TransformFixedParameters'][()]
+                if name in ['AffineTransform', 'MatrixOffsetTransformBase']:
+                    self.transforms.append(AffineTransform(
+                        group[key]['TransformParameters'][()],
+                        fixed_parameters))
+                elif name == 'DisplacementFieldTransform':
+                    field = self.__read_field(
+                        path, group[key]['TransformParameters'], mmap)
+                    self.transforms.append(
+                        DisplacementFieldTransform(field, fixed_parameters))
+                else:
+                    raise NotImplementedError(
+                        f'Transform type {transform_type} is not supported.')
+
+    def __read_field(self, path, dataset, mmap):
+        """Read the displacement field of a transform.
+
+        :param str path: path to the HDF5 transform file
+        :param h5py.Dataset dataset: dataset holding the displacement field
+        :param bool mmap: memory-map the field if it is stored contiguously
+        :return: flat displacement field
+        :rtype: numpy.ndarray
+        """
+        offset = dataset.id.get_offset()
+        if mmap and offset is not None:
+            return np.memmap(path, dtype=dataset.dtype, mode='r',
+                             offset=offset, shape=dataset.shape)
+        return dataset.astype(np.float32)[()]
+
+    def transform_points(self, points):
+        """Transform points in physical space (LPS).
+
+        Like in ITK, the transform added last is applied first.
+
+        :param numpy.ndarray points: Nx3 array of points
+        :return: Nx3 array of transformed points
+        :rtype: numpy.ndarray
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        for transform in reversed(self.transforms):
+            points = transform.transform_points(points)
+        return points
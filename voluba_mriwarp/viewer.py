@@ -1,33 +1,146 @@
+import logging
 import math
+import time
 import tkinter as tk
-import warnings
+from collections import OrderedDict, deque
 from tkinter import ttk
+from types import SimpleNamespace
 
-import numpy as np
-import pandas as pd
 from PIL import Image, ImageTk
 
 from voluba_mriwarp.config import *
 
 
+class ImagePyramid:
+    """Image pyramid whose downsampled levels are built on first use"""
+
+    def __init__(self, image, reduction=2, min_size=512):
+        """Initialize the pyramid.
+
+        :param PIL.Image image: full resolution image
+        :param int reduction: factor between the sizes of two levels
+        :param int min_size: size in pixels below which no further level is
+        created
+        """
+        self.reduction = reduction
+        self.__filter = Image.LANCZOS
+        self.__levels = [image]
+        self.depth = 1
+        w, h = image.size
+        while w > min_size and h > min_size:
+            w /= reduction
+            h /= reduction
+            self.depth += 1
+
+    def level(self, index):
+        """Return a level of the pyramid and build it if necessary.
+
+        :param int index: level to return, 0 is the full resolution
+        :return: image of the level
+        :rtype: PIL.Image
+        """
+        index = min(max(0, index), self.depth - 1)
+        w, h = self.__levels[0].size
+        while len(self.__levels) <= index:
+            factor = self.reduction ** len(self.__levels)
+            self.__levels.append(self.__levels[-1].resize(
+                (int(w / factor), int(h / factor)), self.__filter))
+        return self.__levels[index]
+
+    def close(self):
+        """Close all images of the pyramid."""
+        for image in self.__levels:
+            image.close()
+        del self.__levels[:]
+
+
+class SliceCache:
+    """Least recently used cache of the image pyramids of coronal slices"""
+
+    def __init__(self, volume, size=slice_cache_size):
+        """Initialize the cache.
+
+        :param numpy.ndarray volume: uint8 volume with the coronal slices 
+        along the second axis
+        :param int size: maximum number of cached slices
+        """
+        self.volume = volume
+        self.size = size
+        self.__pyramids = OrderedDict()
+
+    def get(self, index):
+        """Return the image pyramid of a slice.
+
+        :param int index: index of the slice
+        :return: image pyramid of the slice
+        :rtype: ImagePyramid
+        """
+        if index in self.__pyramids:
+            self.__pyramids.move_to_end(index)
+        else:
+            self.__pyramids[index] = ImagePyramid(
+                Image.fromarray(self.volume[:, index, :]))
+            if len(self.__pyramids) > self.size:
+                self.__pyramids.popitem(last=False)
+        return self.__pyramids[index]
+
+    def neighbours(self, index, radius=slice_prefetch):
+        """Return the slices around a slice in both scrolling directions, 
+        nearest first.
+
+        :param int index: index of the shown slice
+        :param int radius: number of slices in each direction
+        :return: indices of the neighbouring slices
+        :rtype: list
+        """
+        return [neighbour for offset in range(1, radius + 1)
+                for neighbour in [index + offset, index - offset]
+                if 0 <= neighbour < self.volume.shape[1]]
+
+    def prepare(self, index, level=0):
+        """Build a level of the image pyramid of a slice.
+
+        :param int index: index of the slice
+        :param int level: pyramid level to build
+        """
+        pyramid = self.__pyramids.get(index)
+        if pyramid is None:
+            pyramid = self.get(index)
+        pyramid.level(level)
+
+
 class ImageCanvas:
     """Canvas to interactively view an image
     Source: https://github.com/foobar167/junkyard/tree/master/manual_image_annotation1/polygon/gui_canvas.py
     """
 
-    def __init__(self, master, image):
+    def __init__(self, master, pyramid):
         """Initialize the canvas.
 
         :param master: tkinter parent widget
-        :param numpy.ndarray image: 2D image to display
+        :param ImagePyramid pyramid: image pyramid of the 2D image to display
         """
         self.zoom = 1.0
         # zoom magnitude
         self.__delta = 1.3
-        self.__filter = Image.LANCZOS
+        # Resample with a cheap filter during interaction and refine the
+        # view with a high quality filter once it settled.
+        self.__filters = {
+            'interactive': getattr(Image, interactive_filter.upper()),
+            'settled': getattr(Image, settled_filter.upper())}
         self.__previous_keyboard_state = 0
-        self.image = np.asarray(image, dtype=np.uint8)
         self.__annotation = (-1, -1, -1)
+        self.__render_pending = False
+        # ids of scheduled Tk callbacks that did not run yet
+        self.__callbacks = set()
+        self.__interactive = False
+        self.__refine_id = None
+        # canvas item and photo image showing the visible part of the image
+        self.__image_id = None
+        self.__tk_image = None
+        # durations in seconds of the most recent renders per filter mode
+        self.frame_times = {mode: deque(maxlen=frame_time_samples)
+                            for mode in self.__filters}
 
         # frame containing the canvas with the image
         self.__image_frame = ttk.Frame(master)
@@ -38,7 +151,7 @@ class ImageCanvas:
         self.canvas.update()
 
         # Bind events to the canvas.
-        self.canvas.bind('<Configure>', lambda event: self.__show_image())
+        self.canvas.bind('<Configure>', lambda event: self.schedule_render())
         self.canvas.bind('<ButtonPress-1>', self.__move_from)
         self.canvas.bind('<Double-Button-1>', self.__annotate)
         self.canvas.bind('<B1-Motion>', self.__move_to)
@@ -51,37 +164,25 @@ class ImageCanvas:
 
         # Handle keystrokes in idle mode.
         self.canvas.bind(
-            '<Key>', lambda event: self.canvas.after_idle(
-                self.__keystroke, event))
+            '<Key>', lambda event: self.__schedule(self.__keystroke, event))
 
         Image.MAX_IMAGE_PIXELS = 1000000000
-        # Suppress DecompressionBombWarning.
-        with warnings.catch_warnings():
-            warnings.simplefilter('ignore')
-            self.__image = Image.fromarray(self.image)
-        self.image_width, self.image_height = self.__image.size
+        # The levels of the image pyramid are built on first use.
+        self.__pyramid = pyramid
+        self.image_width, self.image_height = pyramid.level(0).size
         self.__min_side = min(self.image_width, self.image_height)
 
-        # Create an image pyramid.
-        self.__pyramid = [Image.fromarray(self.image)]
-
         # Set the ratio coefficient for the image pyramid.
         self.__ratio = 1.0
         self.__current_image = 0
         self.__scale = self.zoom * self.__ratio
-        self.__reduction = 2
-        w, h = self.__pyramid[-1].size
-        while w > 512 and h > 512:
-            w /= self.__reduction
-            h /= self.__reduction
-            self.__pyramid.append(
-                self.__pyramid[-1].resize((int(w), int(h)), self.__filter))
+        self.__reduction = pyramid.reduction
 
         # Put the image into a rectangle and use it to set proper coordinates 
         # to the image
         self.container = self.canvas.create_rectangle(
             (0, 0, self.image_width, self.image_height), width=0)
-        self.__show_image()
+        self.__show_image(self.__filters['settled'])
         self.canvas.focus_set()
 
     def get_annotation(self):
@@ -109,23 +210,100 @@ class ImageCanvas:
         :return: cropped image
         :rtype: PIL.Image
         """
-        return self.__pyramid[0].crop(bbox)
+        return self.__pyramid.level(0).crop(bbox)
 
     def move_image_to_center(self):
         """Move the image to the center of the canvas."""
         # Fake an event.
-        event_from = pd.Series(
-            data={'x': self.image_width // 2, 'y': self.image_height // 2},
-            index=['x', 'y'])
-        event_to = pd.Series(
-            data={'x': self.canvas.winfo_width() // 2,
-                  'y': self.canvas.winfo_height() // 2},
-            index=['x', 'y'])
+        event_from = SimpleNamespace(
+            x=self.image_width // 2, y=self.image_height // 2)
+        event_to = SimpleNamespace(
+            x=self.canvas.winfo_width() // 2,
+            y=self.canvas.winfo_height() // 2)
         self.__move_from(event_from)
         self.__move_to(event_to)
 
-    def __show_image(self):
-        """Show the image on the canvas."""
+    def schedule_render(self, interactive=False):
+        """Request a render of the canvas.
+
+        Requests are coalesced into one render of the latest state once the
+        event queue is empty, so slider and mouse events do not pile up.
+
+        :param bool interactive: True if the request stems from an ongoing
+        interaction, i.e. the view is rendered with the interactive filter
+        and refined later
+        """
+        self.__interactive = self.__interactive or interactive
+        if not self.__render_pending:
+            self.__render_pending = True
+            self.__schedule(self.__render)
+
+    def __schedule(self, callback, *args, delay=None):
+        """Run a callback later and remember it until it ran, so that it can
+        be cancelled when the canvas is destroyed.
+
+        :param callback: function to run
+        :param int delay: delay in milliseconds, run once Tk is idle if None
+        :return: id of the scheduled callback
+        :rtype: str
+        """
+        def run():
+            self.__callbacks.discard(callback_id)
+            callback(*args)
+
+        if delay is None:
+            callback_id = self.canvas.after_idle(run)
+        else:
+            callback_id = self.canvas.after(delay, run)
+        self.__callbacks.add(callback_id)
+        return callback_id
+
+    def __cancel(self, callback_id):
+        """Cancel a scheduled callback.
+
+        :param str callback_id: id of the scheduled callback
+        """
+        self.canvas.after_cancel(callback_id)
+        self.__callbacks.discard(callback_id)
+
+    def __render(self):
+        """Render the latest state and schedule its refinement after an
+        interaction.
+        """
+        self.__render_pending = False
+        mode = 'interactive' if self.__interactive else 'settled'
+        self.__interactive = False
+        if self.__refine_id is not None:
+            self.__cancel(self.__refine_id)
+            self.__refine_id = None
+        self.__timed_show_image(mode)
+        if mode == 'interactive':
+            self.__refine_id = self.__schedule(
+                self.__refine, delay=refine_delay)
+
+    def __refine(self):
+        """Render the settled view with the high quality filter."""
+        self.__refine_id = None
+        self.__timed_show_image('settled')
+
+    def __timed_show_image(self, mode):
+        """Show the image on the canvas and record the frame time.
+
+        :param str mode: 'interactive' or 'settled' filter mode
+        """
+        start = time.perf_counter()
+        self.__show_image(self.__filters[mode])
+        frame_time = time.perf_counter() - start
+        self.frame_times[mode].append(frame_time)
+        if frame_time > frame_budget:
+            logging.getLogger(mriwarp_name).debug(
+                f'Viewer frame ({mode}) took {frame_time * 1000:.1f} ms')
+
+    def __show_image(self, filter):
+        """Show the image on the canvas.
+
+        :param int filter: PIL resampling filter for the visible area
+        """
         image_box = self.canvas.coords(self.container)
         canvas_box = (self.canvas.canvasx(0),
                       self.canvas.canvasy(0),
@@ -160,20 +338,35 @@ class ImageCanvas:
 
         # Show image if it in the visible area.
         if int(x2 - x1) > 0 and int(y2 - y1) > 0:
-            image = self.__pyramid[max(0, self.__current_image)].crop((
+            image = self.__pyramid.level(self.__current_image).crop((
                 int(x1 / self.__scale),
                 int(y1 / self.__scale),
                 int(x2 / self.__scale),
                 int(y2 / self.__scale)))
-            
-            tk_image = ImageTk.PhotoImage(image.resize(
-                (int(x2 - x1), int(y2 - y1)), self.__filter))
-            image_id = self.canvas.create_image(
-                max(canvas_box[0], image_box_int[0]), 
-                max(canvas_box[1], image_box_int[1]), 
-                anchor='nw', image=tk_image)
-            self.canvas.lower(image_id)
-            self.canvas.imagetk = tk_image
+            size = (int(x2 - x1), int(y2 - y1))
+            image = image.resize(size, filter)
+
+            # Reuse the canvas item and its photo image. A new photo image is
+            # only needed if the size of the visible area changed.
+            if self.__tk_image is None or (
+                    self.__tk_image.width(), self.__tk_image.height()) != size:
+                self.__tk_image = ImageTk.PhotoImage(image)
+                if self.__image_id is None:
+                    self.__image_id = self.canvas.create_image(
+                        0, 0, anchor='nw', image=self.__tk_image)
+                    self.canvas.lower(self.__image_id)
+                else:
+                    self.canvas.itemconfig(
+                        self.__image_id, image=self.__tk_image)
+            else:
+                self.__tk_image.paste(image)
+            self.canvas.coords(
+                self.__image_id,
+                max(canvas_box[0], image_box_int[0]),
+                max(canvas_box[1], image_box_int[1]))
+            self.canvas.itemconfig(self.__image_id, state='normal')
+        elif self.__image_id is not None:
+            self.canvas.itemconfig(self.__image_id, state='hidden')
 
     def __wheel(self, event):
         """Zoom using the mouse wheel."""
@@ -205,7 +398,7 @@ class ImageCanvas:
         k = self.zoom * self.__ratio
         self.__current_image = min(
             (-1) * int(math.log(k, self.__reduction)),
-            len(self.__pyramid) - 1)
+            self.__pyramid.depth - 1)
         self.__scale = k * math.pow(self.__reduction,
                                     max(0, self.__current_image))
 
@@ -219,7 +412,7 @@ class ImageCanvas:
             self.canvas.scale('annotation', x, y, 1 / scale, 1 / scale)
 
         self.redraw_figures()
-        self.__show_image()
+        self.schedule_render(interactive=True)
 
     def __keystroke(self, event):
         """Scrolling with the keyboard."""
@@ -245,12 +438,12 @@ class ImageCanvas:
     def __scroll_x(self, *args, **kwargs):
         """Scroll canvas horizontally and redraw the image."""
         self.canvas.xview(*args)
-        self.__show_image()
+        self.schedule_render(interactive=True)
 
     def __scroll_y(self, *args, **kwargs):
         """Scroll canvas vertically and redraw the image."""
         self.canvas.yview(*args)
-        self.__show_image()
+        self.schedule_render(interactive=True)
 
     def __move_from(self, event):
         """Remember the previous coordinates for scrolling with the mouse."""
@@ -259,7 +452,7 @@ class ImageCanvas:
     def __move_to(self, event):
         """Drag the canvas to the new position."""
         self.canvas.scan_dragto(event.x, event.y, gain=1)
-        self.__show_image()
+        self.schedule_render(interactive=True)
 
     def __annotate(self, event):
         """Annotate a point on the canvas.
@@ -297,19 +490,21 @@ class ImageCanvas:
         self.canvas.create_oval(
             x - 3, y - 3, x + 3, y + 3, width=0, fill='gold', tags='annotation')
 
-    def update(self, image, slice):
+    def get_level(self):
+        """Return the pyramid level used for the current zoom."""
+        return max(0, self.__current_image)
+
+    def update(self, pyramid, slice):
         """Update the displayed image to the specified slice.
 
-        :param numpy.ndarray image: 2D image to display
+        All slices have the same size, so the current zoom and pyramid level
+        are kept.
+
+        :param ImagePyramid pyramid: image pyramid of the 2D image to display
         :param int slice: currently selected slice
         """
-        self.image = np.asarray(image, dtype=np.uint8)
-        old_scale = self.__scale
-        self.__image = Image.fromarray(self.image)
-        self.image_width, self.image_height = self.__image.size
-        self.__pyramid = [Image.fromarray(self.image)]
-        self.__scale = old_scale
-        self.__show_image()
+        self.__pyramid = pyramid
+        self.schedule_render(interactive=True)
         self.__slice = slice
 
         self.redraw()
@@ -336,9 +531,11 @@ class ImageCanvas:
 
     def destroy(self):
         """Destroy the canvas and its components."""
-        self.__image.close()
-        map(lambda i: i.close, self.__pyramid)
-        del self.__pyramid[:]
+        # Pending renders would otherwise run on the destroyed canvas.
+        for callback_id in list(self.__callbacks):
+            self.__cancel(callback_id)
+        self.__refine_id = None
+        self.__pyramid.close()
         del self.__pyramid
         self.canvas.destroy()
         self.__image_frame.destroy()
@@ -347,17 +544,23 @@ class ImageCanvas:
 class Viewer(ttk.Frame):
     """Viewer displaying the input NIfTI"""
 
-    def __init__(self, master, image, side, padx, pady):
+    def __init__(self, master, volume, slice, side, padx, pady):
         """Initialize the viewer.
 
         :param master: tkinter parent widget
-        :param numpy.ndarray image: 2D image to display
+        :param numpy.ndarray volume: uint8 volume with the coronal slices 
+        along the second axis
+        :param int slice: slice to display initially
         :param str side: side to add the widget for .pack()
         :param int padx: padding in x direction for .pack()
         :param int pady: padding in y direction for .pack()
         """
         ttk.Frame.__init__(self, master=master)
-        self.canvas = ImageCanvas(self.master, image)
+        self.__slices = SliceCache(volume)
+        # slices still to prepare around the latest slice
+        self.__prefetch_queue = deque()
+        self.__prefetch_id = None
+        self.canvas = ImageCanvas(self.master, self.__slices.get(slice))
         self.master.pack_propagate(False)
         self.canvas.pack(side=side, padx=padx, pady=pady)
 
@@ -365,13 +568,52 @@ class Viewer(ttk.Frame):
         """Move the image to the center of the canvas."""
         self.canvas.move_image_to_center()
 
-    def update_image(self, image, slice):
+    def destroy(self):
+        """Destroy the viewer and cancel its scheduled callbacks."""
+        self.__prefetch_queue.clear()
+        if self.__prefetch_id is not None:
+            self.canvas.canvas.after_cancel(self.__prefetch_id)
+            self.__prefetch_id = None
+        self.canvas.destroy()
+        ttk.Frame.destroy(self)
+
+    def update_image(self, slice):
         """Update the displayed image to the specified slice.
 
-        :param numpy.ndarray image: 2D image to display
         :param int slice: currently selected slice
         """
-        self.canvas.update(image, slice)
+        self.canvas.update(self.__slices.get(slice), slice)
+        # Replace the slices still to prepare by the neighbours of the latest
+        # slice.
+        self.__prefetch_queue = deque(self.__slices.neighbours(slice))
+        self.__schedule_prefetch()
+
+    def __schedule_prefetch(self):
+        """Prepare the next queued slice once the viewer is idle.
+
+        Only one slice is prepared per idle callback, so input events are
+        handled in between.
+        """
+        if self.__prefetch_queue and self.__prefetch_id is None:
+            self.__prefetch_id = self.canvas.canvas.after_idle(
+                self.__prefetch_next)
+
+    def __prefetch_next(self):
+        """Prepare the next queued slice at the current zoom."""
+        self.__prefetch_id = None
+        if self.__prefetch_queue:
+            self.__slices.prepare(
+                self.__prefetch_queue.popleft(), self.canvas.get_level())
+        self.__schedule_prefetch()
+
+    def get_frame_times(self):
+        """Return the durations in seconds of the most recent renders.
+
+        :return: frame times of the 'interactive' and 'settled' filter modes
+        :rtype: dict
+        """
+        return {mode: list(frame_times)
+                for mode, frame_times in self.canvas.frame_times.items()}
 
     def get_annotation(self):
         """Return the current annotation."""
@@ -2,9 +2,10 @@ import os
 import threading
 import tkinter as tk
 import webbrowser
-from tkinter import filedialog, simpledialog, ttk
+from tkinter import filedialog, messagebox, simpledialog, ttk
 
-from voluba_mriwarp.config import mriwarp_home
+from voluba_mriwarp.config import mriwarp_home, quality_profiles
+from voluba_mriwarp.filters import OPERATORS, AssignmentFilter
 
 
 class ExportDialog(simpledialog.Dialog):
@@ -42,7 +43,7 @@ class ExportDialog(simpledialog.Dialog):
         # widgets for export location
         location_frame = tk.Frame(frame)
         location_frame.grid(column=0, row=0, pady=5, sticky='w')
-        label = tk.Label(location_frame, text='PDF location: ', anchor='w')
+        label = tk.Label(location_frame, text='Export location: ', anchor='w')
         label.pack(side='left')
         self.__path_var = tk.StringVar()
         path = tk.Entry(location_frame, textvariable=self.__path_var, width=39)
@@ -60,22 +61,31 @@ class ExportDialog(simpledialog.Dialog):
             filter_frame, text='Export regions assigned with:',
             anchor='w')
         label.pack(anchor='w')
-        keys = ['correlation', 'intersection over union', 'map value',
-                'map weighted mean', 'map containedness',
-                'input weighted mean', 'input containedness']
-        self.__column = tk.StringVar()
-        dropdown = ttk.OptionMenu(filter_frame, self.__column, keys[0], *keys)
-        dropdown.pack(side='left')
-        self.__sign = tk.StringVar()
-        signs = ['>', '>=', '=', '<=', '<']
-        dropdown = ttk.OptionMenu(filter_frame, self.__sign, signs[0], *signs)
+        self.__conditions = []
+        self.__condition_frame = tk.Frame(filter_frame)
+        self.__condition_frame.pack(anchor='w')
+        self.__add_condition()
+
+        options_frame = tk.Frame(filter_frame)
+        options_frame.pack(anchor='w', pady=(5, 0))
+        button = tk.Button(options_frame, text='+ condition',
+                           command=self.__add_condition, padx=2.5)
+        button.pack(side='left')
+        label = tk.Label(options_frame, text=' Combine with')
+        label.pack(side='left')
+        self.__combine = tk.StringVar()
+        dropdown = ttk.OptionMenu(
+            options_frame, self.__combine, 'and', 'and', 'or')
         dropdown.pack(side='left')
-        self.__value = tk.DoubleVar()
-        self.__value.set(0.3)
-        vcmd = (self.register(self.__validate_float), '%P')
-        entry = tk.Entry(filter_frame, textvariable=self.__value,
+        label = tk.Label(options_frame, text=' Keep at most')
+        label.pack(side='left')
+        self.__top_k = tk.StringVar()
+        vcmd = (self.register(self.__validate_int), '%P')
+        entry = tk.Entry(options_frame, textvariable=self.__top_k, width=4,
                          validate='key', validatecommand=vcmd)
         entry.pack(side='left')
+        label = tk.Label(options_frame, text='regions per point')
+        label.pack(side='left')
 
         # widgets for feature selection
         feature_frame = tk.Frame(frame)
@@ -129,6 +139,16 @@ class ExportDialog(simpledialog.Dialog):
         self.__tick_cohort()
         self.__change_extended_feature_visibility('StreamlineCounts')
 
+        # widgets for figure quality
+        quality_frame = tk.Frame(frame)
+        quality_frame.grid(column=0, row=5, pady=5, sticky='w')
+        label = tk.Label(quality_frame, text='Figure quality: ', anchor='w')
+        label.pack(side='left')
+        self.__quality = tk.StringVar()
+        dropdown = ttk.OptionMenu(
+            quality_frame, self.__quality, 'screen', *quality_profiles)
+        dropdown.pack(side='left')
+
     def buttonbox(self):
         """Add the button box.
 
@@ -180,6 +200,65 @@ class ExportDialog(simpledialog.Dialog):
                 self.__cohort_frame.grid()
             self.update()
 
+    def __add_condition(self):
+        """Add a row for another filter condition."""
+        keys = ['correlation', 'intersection over union', 'map value',
+                'map weighted mean', 'map containedness',
+                'input weighted mean', 'input containedness']
+        signs = list(OPERATORS)
+        row = tk.Frame(self.__condition_frame)
+        row.pack(anchor='w')
+
+        column = tk.StringVar()
+        dropdown = ttk.OptionMenu(row, column, keys[0], *keys)
+        dropdown.pack(side='left')
+        sign = tk.StringVar()
+        dropdown = ttk.OptionMenu(row, sign, '>', *signs)
+        dropdown.pack(side='left')
+        value = tk.DoubleVar()
+        value.set(0.3)
+        vcmd = (self.register(self.__validate_float), '%P')
+        entry = tk.Entry(row, textvariable=value, validate='key',
+                         validatecommand=vcmd)
+        entry.pack(side='left')
+
+        condition = (row, column, sign, value)
+        button = tk.Button(
+            row, text='-', padx=2.5,
+            command=lambda: self.__remove_condition(condition))
+        button.pack(side='left', padx=5)
+        self.__conditions.append(condition)
+
+    def __remove_condition(self, condition):
+        """Remove the row of a filter condition.
+
+        :param tuple condition: row and variables of the condition
+        """
+        # Keep at least one condition.
+        if len(self.__conditions) > 1:
+            self.__conditions.remove(condition)
+            condition[0].destroy()
+
+    def __get_filter(self):
+        """Compile the entered conditions into a filter.
+
+        :return: filter to apply to the assignments
+        :rtype: voluba_mriwarp.filters.AssignmentFilter
+        """
+        conditions = [[column.get(), sign.get(), float(value.get())]
+                      for _, column, sign, value in self.__conditions]
+        top_k = int(self.__top_k.get() or 0) or None
+        return AssignmentFilter(conditions, self.__combine.get(), top_k)
+
+    def __validate_int(self, value):
+        """Validate if the entered number of regions is empty or an integer.
+
+        :param str value: value to check
+        :return: True if the given value is empty or an integer or else False.
+        :rtype: bool
+        """
+        return value == '' or value.isdigit()
+
     def __validate_float(self, value):
         """Validate if the entered filter is a numerical value.
 
@@ -200,7 +279,10 @@ class ExportDialog(simpledialog.Dialog):
             title='Select export location',
             initialdir=os.path.dirname(self.__path_var.get()),
             initialfile=os.path.basename(self.__path_var.get()),
-            defaultextension='.pdf', filetypes=[('PDF', '*.pdf')],
+            defaultextension='.pdf',
+            filetypes=[('PDF report', '*.pdf'), ('CSV table', '*.csv'),
+                       ('Parquet table', '*.parquet'),
+                       ('JSON table', '*.json')],
             confirmoverwrite=True)
 
         # Canceling the filedialog returns an empty string.
@@ -211,12 +293,19 @@ class ExportDialog(simpledialog.Dialog):
     def export(self, event=None):
         """Start the export to PDF of all assignments and linked features that
         are selected.
+
+        If a table format is selected as export location, only the
+        assignments are exported without plotting.
         """
+        path = self.__path_var.get()
+        table = os.path.splitext(path)[1].lower() in [
+            '.csv', '.parquet', '.json']
         for widget in self.winfo_children():
             widget.destroy()
 
         # Show progress.
-        label = tk.Label(self, text='Exporting to PDF ...')
+        text = 'Exporting table ...' if table else 'Exporting to PDF ...'
+        label = tk.Label(self, text=text)
         label.pack(anchor='w', padx=5, pady=5)
         progress_bar = ttk.Progressbar(
             self, orient='horizontal', variable=self.progress, length=200)
@@ -232,20 +321,39 @@ class ExportDialog(simpledialog.Dialog):
                      if self.__receptors[receptor].get() == 1]
         cohorts = [cohort for cohort in self.__cohorts
                    if self.__cohorts[cohort].get() == 1]
-        filter = [
-            self.__column.get(),
-            self.__sign.get(),
-            float(self.__value.get())]
-
-        thread = threading.Thread(
-            target=self.__logic.export_assignments,
-            args=(self.__path_var.get(), filter, features, 
-                  receptors, cohorts, self.progress),
-            daemon=True)
+        filter = self.__get_filter()
+
+        # Pass errors of the export back to the main thread.
+        errors = []
+
+        def run(target, *args):
+            try:
+                target(*args)
+            except Exception as e:
+                errors.append(e)
+
+        if table:
+            thread = threading.Thread(
+                target=run, args=(self.__logic.export_table, path, filter),
+                daemon=True)
+        else:
+            thread = threading.Thread(
+                target=run,
+                args=(self.__logic.export_assignments, path, filter, features,
+                      receptors, cohorts, self.progress,
+                      self.__quality.get()),
+                daemon=True)
         thread.start()
 
         while thread.is_alive():
             self.update()
+        if errors:
+            messagebox.showerror(
+                'Error', f'The export failed: {str(errors[0])}', parent=self)
+            self.cancel()
+            return
+        if table:
+            self.progress.set(100)
 
         self.after(3000, self.cancel)
 
@@ -317,15 +425,15 @@ class customTreeView(ttk.Treeview):
         """
         self._sort(column, reverse, str, self._sort_by_str)
 
-    def open_url(self, event, urls):
+    def open_url(self, event, get_url):
         """Open the corresponding region of the selected row in 
         siibra-explorer.
 
-        :param dict urls: dictionary of regions and their corresponding 
-        siibra-explorer url
+        :param func get_url: function returning the siibra-explorer url of a
+        region name
         """
         selected_row = self.selection()
         row_values = self.item(selected_row, 'values')
         if row_values:
             # The first row value is the region.
-            webbrowser.open(urls[row_values[0]])
+            webbrowser.open(get_url(row_values[0]))